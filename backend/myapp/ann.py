@@ -0,0 +1,94 @@
+import logging
+import math
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+
+
+def wants_ann(index):
+    """True when a flat index has grown past KNOWLEDGE_BASE_ANN_MIN_CHUNKS and an ANN type is configured."""
+    index_type = settings.KNOWLEDGE_BASE_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"KNOWLEDGE_BASE_INDEX_TYPE must be one of {', '.join(INDEX_TYPES)}")
+    return (index_type != "flat"
+            and isinstance(index, faiss.IndexFlat)
+            and index.ntotal >= settings.KNOWLEDGE_BASE_ANN_MIN_CHUNKS)
+
+
+def build_ann_index(vectors):
+    """
+    Build an index of the configured approximate type holding vectors, in order,
+    so positions in the old index map to the same docstore ids.
+    """
+    count, dimension = vectors.shape
+    index_type = settings.KNOWLEDGE_BASE_INDEX_TYPE
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings.KNOWLEDGE_BASE_HNSW_M)
+        index.hnsw.efConstruction = settings.KNOWLEDGE_BASE_HNSW_EF_CONSTRUCTION
+    else:
+        nlist = settings.KNOWLEDGE_BASE_IVF_NLIST or max(1, int(4 * math.sqrt(count)))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivfpq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist,
+                                     settings.KNOWLEDGE_BASE_PQ_M, settings.KNOWLEDGE_BASE_PQ_NBITS)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        sample = vectors
+        if count > settings.KNOWLEDGE_BASE_TRAIN_SAMPLE:
+            rows = np.random.default_rng(0).choice(count, settings.KNOWLEDGE_BASE_TRAIN_SAMPLE, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    index.add(vectors)
+    configure_search(index)
+    return index
+
+
+def index_vectors(index):
+    """
+    All vectors stored in an in-memory index, in position order. IVF-PQ
+    indexes only hold compressed codes, so theirs come back approximate.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def migrate_to_ann(index):
+    """Return an approximate index holding the same vectors as a flat index."""
+    vectors = index_vectors(index)
+    logger.info("Migrating %d chunks to a %s index", index.ntotal, settings.KNOWLEDGE_BASE_INDEX_TYPE)
+    return build_ann_index(vectors)
+
+
+def read_index(path, mmap=False):
+    """
+    Read a saved index. With mmap the vectors (or IVF inverted lists) stay in
+    the file and are paged in on demand, so every process serving the same
+    snapshot shares one page-cached copy; such an index is read-only.
+    """
+    if mmap:
+        with open(path, "rb") as f:
+            ivf = f.read(2) == b"Iw"
+        # Flat and HNSW codes map through IO_FLAG_MMAP_IFC, IVF lists only through IO_FLAG_MMAP
+        flags = faiss.IO_FLAG_MMAP if ivf else getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return configure_search(faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY))
+        except RuntimeError as e:
+            logger.warning("Could not memory-map %s, reading it into memory: %s", path, e)
+    return configure_search(faiss.read_index(path))
+
+
+def configure_search(index):
+    """Apply the recall-vs-latency settings (nprobe, efSearch) to a loaded index."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = settings.KNOWLEDGE_BASE_IVF_NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.KNOWLEDGE_BASE_HNSW_EF_SEARCH
+    return index
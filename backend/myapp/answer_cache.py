@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .lexical import tokenize
+
+IDENTIFIER_RE = re.compile(r"[0-9._:/-]")
+SNAKE_CASE_RE = re.compile(r"\b[a-z0-9]+(?:_[a-z0-9]+)+\b")
+
+
+def normalize_text(question):
+    return " ".join(question.lower().split())
+
+
+def identifiers(question):
+    """
+    The tokens of a question that name one specific thing: CVE ids, ports,
+    table.column and snake_case field names. Embeddings barely tell
+    "field src_ip in firewall_logs" from "field dst_ip in firewall_logs".
+    """
+    text = question.lower()
+    return frozenset([token for token in tokenize(text) if IDENTIFIER_RE.search(token)]
+                     + SNAKE_CASE_RE.findall(text))
+
+
+class AnswerScope:
+    """
+    What the cached answer to a question depends on: its prompt group and the
+    version, i.e. the (prompt version, knowledge base revision) pair, that was
+    read for it at read_at, a time.monotonic() taken before reading it.
+    """
+
+    def __init__(self, group, version, read_at):
+        self.group = group
+        self.version = version
+        self.read_at = read_at
+
+
+class GroupAnswers:
+    """The cached answers of one prompt group, for the version it moved to at since."""
+
+    def __init__(self, version, since):
+        self.version = version
+        self.since = since
+        self.entries = OrderedDict()  # id -> (unit vector or None, identifiers, text, answer, stored at)
+
+
+class SemanticAnswerCache:
+    """
+    Answers to previous questions, looked up by question-embedding similarity.
+
+    Each prompt group has its own least recently used list of answers, which
+    is emptied when the group's prompt or knowledge base changes; other groups
+    keep theirs. A question only reuses an answer when both name the same
+    identifiers. Questions stored without a vector, such as bare identifiers,
+    only match the same text. Entries expire after ttl seconds, and the least
+    recently used are evicted past max_entries per group.
+    """
+
+    def __init__(self, threshold=None, ttl=None, max_entries=None):
+        self.threshold = settings.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = settings.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.max_entries = settings.ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._groups = {}  # prompt group -> GroupAnswers
+        self._next_id = 0
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _answers(self, scope):
+        """
+        The answers of scope's group, emptied first when scope brings a new
+        version. None when scope was read before the group moved to its current
+        version: a slow request must not bring back an outdated prompt or
+        knowledge base.
+        """
+        answers = self._groups.get(scope.group)
+        if answers is not None and answers.version == scope.version:
+            return answers
+        if answers is not None and scope.read_at < answers.since:
+            return None
+        answers = GroupAnswers(scope.version, time.monotonic())
+        self._groups[scope.group] = answers
+        return answers
+
+    def _expire(self, entries):
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        for entry_id in [entry_id for entry_id, entry in entries.items() if entry[4] < deadline]:
+            del entries[entry_id]
+
+    def lookup(self, scope, vector, question):
+        """
+        Return the cached answer whose question is closest to vector and names
+        the same identifiers, if it clears the threshold, else None. Without a
+        vector only an answer to the same question text is returned.
+        """
+        key, text = identifiers(question), normalize_text(question)
+        with self._lock:
+            answers = self._answers(scope)
+            match = None
+            if answers is not None:
+                self._expire(answers.entries)
+                if vector is None:
+                    match = next((entry_id for entry_id, entry in answers.entries.items() if entry[2] == text), None)
+                else:
+                    match = self._nearest(answers.entries, vector, key)
+            if match is None:
+                self.misses += 1
+                return None
+            answers.entries.move_to_end(match)
+            self.hits += 1
+            return answers.entries[match][3]
+
+    def _nearest(self, entries, vector, key):
+        ids = [entry_id for entry_id, entry in entries.items() if entry[0] is not None and entry[1] == key]
+        if not ids:
+            return None
+        matrix = np.stack([entries[entry_id][0] for entry_id in ids])
+        similarities = matrix @ self._normalize(vector)
+        best = int(np.argmax(similarities))
+        return ids[best] if similarities[best] >= self.threshold else None
+
+    def store(self, scope, vector, question, answer):
+        vector = None if vector is None else self._normalize(vector)
+        key, text = identifiers(question), normalize_text(question)
+        with self._lock:
+            answers = self._answers(scope)
+            if answers is None:
+                return
+            answers.entries[self._next_id] = (vector, key, text, answer, time.monotonic())
+            self._next_id += 1
+            while len(answers.entries) > self.max_entries:
+                answers.entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": sum(len(answers.entries) for answers in self._groups.values())}
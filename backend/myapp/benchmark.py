@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import os
+import random
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from rest_framework.test import APIRequestFactory
+
+from .metrics import finish_trace, start_trace
+from .models import IngestionJob
+from .tokens import message_text, message_tokens
+
+WORDS = (
+    "alert auth bucket cluster credential dns endpoint event firewall hash host identity incident ingress "
+    "kerberos lateral log malware network packet payload policy port process proxy query registry role "
+    "session signature socket subnet table telemetry threat ticket token traffic user vulnerability"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Stand-in for ChatOpenAI that answers after a fixed latency, for benchmarks without API calls."""
+
+    latency: float = 0.0
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self):
+        return "benchmark-fake"
+
+    def _reply(self, messages):
+        question = message_text(messages[-1])
+        rng = random.Random(question)
+        content = " ".join(rng.choice(WORDS) for _ in range(self.answer_words))
+        prompt_tokens = sum(message_tokens(message) for message in messages)
+        usage = {"input_tokens": prompt_tokens, "output_tokens": self.answer_words,
+                 "total_tokens": prompt_tokens + self.answer_words}
+        return AIMessage(content=content, usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # The latency is spent before the first token, like a provider's time to first byte
+        time.sleep(self.latency)
+        for word in self._reply(messages).content.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+class FakeEmbeddings(Embeddings):
+    """Stand-in for OpenAIEmbeddings returning deterministic unit vectors after a fixed latency per call."""
+
+    def __init__(self, latency=0.0, dimension=1536):
+        self.latency = latency
+        self.dimension = dimension
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: fall back to the process-wide peak, which never goes down
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRss:
+    """Samples the resident set size in the background and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def summarize(seconds):
+    """Latency percentiles in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def make_corpus(documents, chunks_per_document, chunk_size, seed=0):
+    """Synthetic text documents of roughly chunks_per_document chunks each, all distinct."""
+    rng = random.Random(seed)
+    corpus = []
+    for number in range(documents):
+        words, size = [f"document-{number}"], 0
+        while size < chunks_per_document * chunk_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def make_questions(count, seed=1):
+    rng = random.Random(seed)
+    return [f"question {number}: how does the {rng.choice(WORDS)} {rng.choice(WORDS)} relate to "
+            f"{rng.choice(WORDS)}?" for number in range(count)]
+
+
+def bench_uploads(view, corpus, concurrency, poll_interval=0.05):
+    """
+    POST every document to the chat view as an upload, then wait for the
+    background ingestion jobs. Reports the upload request latency and the
+    time from upload to indexed document.
+    """
+    factory = APIRequestFactory()
+    submitted = {}
+    request_seconds = []
+    errors = 0
+
+    def upload(number):
+        upload_file = SimpleUploadedFile(f"benchmark-{number}.txt", corpus[number].encode("utf-8"),
+                                         content_type="text/plain")
+        request = factory.post("/api/chat/", {"image": upload_file}, format="multipart")
+        started = time.perf_counter()
+        response = view(request)
+        request_seconds.append(time.perf_counter() - started)
+        if response.status_code == 202:
+            submitted[response.data["answer"]["job_id"]] = started
+        return response.status_code
+
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            errors += sum(1 for status in pool.map(upload, range(len(corpus))) if status != 202)
+
+        ingest_seconds, chunks = [], 0
+        pending = dict(submitted)
+        while pending:
+            time.sleep(poll_interval)
+            for job in IngestionJob.objects.filter(pk__in=list(pending),
+                                                   status__in=[IngestionJob.DONE, IngestionJob.DUPLICATE,
+                                                               IngestionJob.FAILED]):
+                ingest_seconds.append(time.perf_counter() - pending.pop(job.id))
+                chunks += job.chunks_embedded
+                errors += job.status == IngestionJob.FAILED
+        wall = time.perf_counter() - started
+
+    return {
+        "documents": len(corpus),
+        "chunks": chunks,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "documents_per_second": round(len(corpus) / wall, 3),
+        "chunks_per_second": round(chunks / wall, 3),
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "upload_request": summarize(request_seconds),
+        "upload_to_indexed": summarize(ingest_seconds),
+    }
+
+
+def bench_chat(view, questions, concurrency):
+    """POST every question to the chat view. Reports request latency and the latency of each pipeline stage."""
+    factory = APIRequestFactory()
+    request_seconds, stages = [], {}
+    errors = 0
+
+    def ask(question):
+        request = factory.post("/api/chat/", {"question": question}, format="json")
+        trace = start_trace("/api/chat/")
+        response = view(request)
+        finish_trace(trace, response.status_code)
+        request_seconds.append(time.perf_counter() - trace.started)
+        for stage, ms in trace.stages.items():
+            stages.setdefault(stage, []).append(ms / 1000)
+        return response.status_code
+
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            errors += sum(1 for status in pool.map(ask, questions) if status != 200)
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": len(questions),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(questions) / wall, 3),
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "latency": summarize(request_seconds),
+        "stages": {stage: summarize(seconds) for stage, seconds in sorted(stages.items())},
+    }
@@ -0,0 +1,656 @@
+# Import standard library modules
+import os
+import asyncio
+import threading
+import time
+import weakref
+import base64
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+import csv
+import logging
+
+# Import third-party libraries
+from dotenv import load_dotenv
+
+# Import Django modules
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# Import LangChain related modules
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain.embeddings import OpenAIEmbeddings
+
+from .answer_cache import AnswerScope, SemanticAnswerCache
+from .context import assemble_prompt
+from .conversations import ConversationStore
+from .embeddings import CachedEmbeddings
+from .ingestion import embed_batches, iter_uploaded_pdf, report_progress, split_segments, timed
+from .jobs import start_lease_keeper
+from .knowledge_base import KnowledgeBase
+from .metrics import record_cache, record_tokens, span
+from .models import KnowledgeDocument
+from .prompts import prompt_resolver
+from .scheduler import Rejected, embedding_scheduler, llm_scheduler
+from .tokens import count_tokens, message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+
+class FileType(Enum):
+    FILE = 'FILE'
+    IMAGE = 'IMAGE'
+    UNKNOWN = 'UNKNOWN'
+
+
+class PreparedAnswer:
+    """A question ready to stream: its history and prompt built, its model call admitted."""
+
+    def __init__(self, conversation_id, chat_history, human_message, prompt, estimate):
+        self.conversation_id = conversation_id
+        self.chat_history = chat_history
+        self.human_message = human_message
+        self.prompt = prompt
+        self.estimate = estimate
+
+
+class ChatBot:
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            # Created on first use, possibly by several request threads at once
+            with cls._instance_lock:
+                if not cls._instance:
+                    instance = super(ChatBot, cls).__new__(cls)
+                    instance.initialize_bot()
+                    cls._instance = instance
+        return cls._instance
+
+    def initialize_bot(self):
+        self.chatmodel = ChatOpenAI(
+            model=settings.CHAT_MODEL,
+            temperature=0,
+            openai_api_key=os.getenv("OPENAI_API_KEY")
+        )
+        self.conversations = ConversationStore()
+        self._system_message = None
+        self._system_message_version = None
+        self._llm_semaphores = weakref.WeakKeyDictionary()
+        self.embeddings = CachedEmbeddings(
+            OpenAIEmbeddings(model=settings.EMBEDDING_MODEL),
+            model=settings.EMBEDDING_MODEL,
+            scheduler=embedding_scheduler,
+        )
+        self._knowledge_bases = {}
+        self._knowledge_bases_lock = threading.Lock()
+        self.answer_cache = SemanticAnswerCache()
+        logger.info("Chat bot initialized")
+
+    def knowledge_base(self, group=None):
+        """
+        The knowledge base of a prompt group, or the shared one when group is None.
+        Each group has its own index directory, so searches only touch its vectors.
+        """
+        with self._knowledge_bases_lock:
+            knowledge_base = self._knowledge_bases.get(group)
+            if knowledge_base is None:
+                index_path = settings.KNOWLEDGE_BASE_DIR
+                if group is not None:
+                    index_path = os.path.join(index_path, "groups", str(group))
+                knowledge_base = KnowledgeBase(self.embeddings, index_path)
+                self._knowledge_bases[group] = knowledge_base
+            return knowledge_base
+
+    def answer(self, question, conversation_id=None, group=None):
+        # Only standalone questions are answered from the cache; follow-ups depend on the history
+        if self.conversations.load(conversation_id):
+            return self.chain(question, conversation_id, group)
+
+        knowledge_base = self.knowledge_base(group)
+        with span("index_load"):
+            scope = self.answer_scope(group)
+            # Identifiers are retrieved without embedding them; cache their answers by text instead
+            exact = knowledge_base.is_identifier(question)
+        try:
+            with span("embedding"):
+                question_vector = None if exact else self.embeddings.embed_query(question)
+        except Rejected:
+            raise
+        except Exception as e:
+            # The cache is an optimisation; answer the question without it
+            logger.warning("Embedding the question for the answer cache failed: %s", e)
+            return self.chain(question, conversation_id, group)
+        content = self.answer_cache.lookup(scope, question_vector, question)
+        record_cache("answer", hits=content is not None, misses=content is None)
+        if content is not None:
+            humanMsgs = HumanMessage(content=[self.set_human_msg(question)])
+            self.remember(conversation_id, [], humanMsgs, content)
+            return content
+
+        content = self.chain(question, conversation_id, group)
+        self.answer_cache.store(scope, question_vector, question, content)
+        return content
+
+    def answer_scope(self, group):
+        """The AnswerScope of a standalone question to group, as of now."""
+        # Timed before reading the versions, which may change meanwhile
+        read_at = time.monotonic()
+        return AnswerScope(group, (prompt_resolver.version, self.knowledge_base(group).revision), read_at)
+
+    def answer_many(self, questions, group=None):
+        """
+        Answer a list of standalone questions, returning one {"answer": ...} or
+        {"error": ...} dict per question, in order.
+
+        The questions, bare identifiers aside, are embedded in one call, which
+        serves both the answer cache and retrieval, and searched in one pass
+        over the knowledge base. At most BATCH_LLM_CONCURRENCY model calls run
+        at once.
+        """
+        knowledge_base = self.knowledge_base(group)
+        with span("index_load"):
+            scope = self.answer_scope(group)
+            to_embed = [i for i, question in enumerate(questions) if not knowledge_base.is_identifier(question)]
+        vectors = [None] * len(questions)
+        try:
+            if to_embed:
+                with span("embedding"):
+                    for i, vector in zip(to_embed, self.embeddings.embed_documents([questions[i] for i in to_embed])):
+                        vectors[i] = vector
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("Embedding the questions for the answer cache failed: %s", e)
+            vectors = None
+        results = [None] * len(questions)
+        for i, vector in enumerate(vectors or []):
+            content = self.answer_cache.lookup(scope, vector, questions[i])
+            if content is not None:
+                results[i] = {"answer": content}
+        pending = [i for i, result in enumerate(results) if result is None]
+        record_cache("answer", hits=len(questions) - len(pending), misses=len(pending))
+        if not pending:
+            return results
+
+        try:
+            hits = knowledge_base.search_many([questions[i] for i in pending], settings.RAG_TOP_K,
+                                              vectors=[vectors[i] for i in pending] if vectors else None)
+            hits = [self.relevant(question_hits) for question_hits in hits]
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("Searching the knowledge base failed: %s", e)
+            hits = [[] for _ in pending]
+
+        with span("prompt"):
+            system_message = self.system_message()
+            prompts = [
+                assemble_prompt(system_message, [], HumanMessage(content=[self.set_human_msg(questions[i])]),
+                                question_hits)
+                for i, question_hits in zip(pending, hits)
+            ]
+        # Each call runs in a copy of the request's context, keeping its trace and scheduling priority
+        with ThreadPoolExecutor(max_workers=settings.BATCH_LLM_CONCURRENCY) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self.invoke_llm, prompt) for prompt in prompts]
+        for i, future in zip(pending, futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                results[i] = {"error": str(e)}
+                continue
+            if vectors:
+                self.answer_cache.store(scope, vectors[i], questions[i], response.content)
+            results[i] = {"answer": response.content}
+        return results
+
+    # def chain(self, question, image_path="logical_dataflow.png"):
+    def chain(self, question, conversation_id=None, group=None):
+        humanMsgList = []
+        humanMsgList.extend([self.set_human_msg(question)])
+        humanMsgs = HumanMessage(content=humanMsgList)
+
+        # humanMsgs.extend(multi_modal_questions())
+
+        # History only carries human/AI turns; the system block is sent once, first
+        chat_history = self.conversations.load(conversation_id)
+
+        try:
+            hits = self.search_from_knowledge_base(self.retrieval_query(question, chat_history), group)
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("Searching the knowledge base failed: %s", e)
+            hits = []
+
+        # One model call either way: with the relevant context, or without any
+        with span("prompt"):
+            prompt = assemble_prompt(self.system_message(), chat_history, humanMsgs, hits)
+        response = self.invoke_llm(prompt)
+        self.remember(conversation_id, chat_history, humanMsgs, response.content)
+        return response.content
+
+    def estimate_tokens(self, prompt):
+        """Tokens a model call is charged before it runs: the prompt plus LLM_COMPLETION_TOKENS."""
+        return sum(message_tokens(message) for message in prompt) + settings.LLM_COMPLETION_TOKENS
+
+    def invoke_llm(self, prompt):
+        """Call the chat model once llm_scheduler admits the call, and count the tokens it used."""
+        estimate = self.estimate_tokens(prompt)
+        llm_scheduler.acquire(estimate)
+        with span("llm"):
+            response = self.chatmodel.invoke(prompt)
+        llm_scheduler.settle(estimate, self.record_usage(prompt, response))
+        return response
+
+    def record_usage(self, prompt, response):
+        """
+        Count the tokens of a model call, as reported by the provider or else
+        estimated, and return their total.
+        """
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        else:
+            prompt_tokens = sum(message_tokens(message) for message in prompt)
+            completion_tokens = count_tokens(response.content)
+        record_tokens(prompt_tokens, completion_tokens)
+        return prompt_tokens + completion_tokens
+
+    def remember(self, conversation_id, chat_history, human_message, answer):
+        chat_history.extend([human_message, AIMessage(content=answer)])
+        self.conversations.save(conversation_id, chat_history)
+
+    def system_message(self):
+        """
+        The system block that prefixes every request.
+
+        It is rebuilt only when the admin prompts change, so the prompt prefix
+        stays byte-identical between turns and provider-side prefix caching applies.
+        """
+        version = prompt_resolver.version
+        if self._system_message_version != version:
+            systemMsgList = []
+            systemMsgList.extend([self.set_default_prompt(), self.set_system_prompt(), self.set_admin_prompt()])
+            self._system_message = SystemMessage(content=systemMsgList)
+            self._system_message_version = version
+        return self._system_message
+
+    def set_default_prompt(self):
+        defaultPrompt = """
+                you are a data dict bot aims to help users to answers the data relevant qs in cybersecurity.
+                """
+
+        return {"type": "text", "text": f"{defaultPrompt}"}
+
+    def set_system_prompt(self):
+        # prompt from rules
+        system_prompt_str = f"""
+                        Based on the user's input, here are some conversational rules to follow:
+                            1. The user's request
+                            2. output passe need to follow
+                        """
+        return {"type": "text", "text": f"{system_prompt_str}"}
+
+    def set_admin_prompt(self):
+        # prompt from db, served from the in-process prompt cache
+        admin_prompt_str = prompt_resolver.admin_prompt()
+        return {"type": "text", "text": f"{admin_prompt_str}"}
+
+    def set_human_msg(self, question):
+        return {"type": "text", "text": f"{question}"}
+
+    def multi_modal_questions(self, upload_file):
+        file_result = self.upload_file(upload_file)
+        multi_modal_questions = []
+        file_content = file_result['content']
+        if file_result['type'] == FileType.FILE.value:
+            multi_modal_questions.append({"type": "text", "text": f"{file_content}"})
+        if file_result['type'] == FileType.IMAGE.value:
+            multi_modal_questions.append(
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{file_content}"}}, )
+
+        return multi_modal_questions
+
+    def process_upload_files(self, upload_file):
+        """
+        Read an uploaded file. Text files also return "segments", an iterable of
+        (text, metadata) pairs tagged with the page or row range they came from.
+        PDFs are streamed page by page, so their "content" is None.
+        """
+        file_type_ext = upload_file.name.split(".")[-1].lower()
+        segments = []
+        if file_type_ext == 'txt':
+
+            file_type = FileType.FILE
+            file_content = upload_file.read().decode('utf-8')
+            content = file_content
+            segments.append((content, {}))
+
+        elif file_type_ext == 'pdf':
+            file_type = FileType.FILE
+            # Pages are extracted lazily in a process pool as the segments are consumed
+            content = None
+            segments = iter_uploaded_pdf(upload_file)
+
+        elif file_type_ext in ['jpg', 'jpeg', 'png']:
+            file_type = FileType.IMAGE
+            base64_image = base64.b64encode(upload_file.read()).decode('utf-8')
+            content = base64_image
+
+        elif file_type_ext == 'csv':
+            file_type = FileType.FILE
+            csv_content = upload_file.read().decode('utf-8').splitlines()
+            reader = csv.reader(csv_content)
+            lines = [", ".join(row) for row in reader]
+            content = "\n".join(lines)
+            segments.extend(self.csv_row_blocks(lines))
+        else:
+            file_type = FileType.UNKNOWN
+            content = "Unsupported file type"
+
+        return {"type": file_type.value, "content": content, "segments": segments}
+
+    def csv_row_blocks(self, lines):
+        # Group csv rows into chunk-sized blocks so every chunk maps to a row range
+        block, size, first_row = [], 0, 1
+        for row_number, line in enumerate(lines, start=1):
+            if block and size + len(line) > settings.INGESTION_CHUNK_SIZE:
+                yield "\n".join(block), {"rows": f"{first_row}-{row_number - 1}"}
+                block, size, first_row = [], 0, row_number
+            block.append(line)
+            size += len(line) + 1
+        if block:
+            yield "\n".join(block), {"rows": f"{first_row}-{first_row + len(block) - 1}"}
+
+    def update_knowledge_base(self, file_result, source, progress=None, group=None, digest=None, replaces=None):
+        """
+        Chunk, embed and index an uploaded file into the knowledge base of group
+        and record it as a KnowledgeDocument. progress, if given, is called as
+        progress(pages_parsed=n) and progress(chunks_embedded=n) along the way.
+
+        A file whose content hash (digest) is already registered in the group is
+        not ingested again. replaces is the id of a document to delete once the
+        new one is indexed. Returns (message, KnowledgeDocument or None, whether
+        the file was a duplicate).
+        """
+        if file_result['type'] != FileType.FILE.value:
+            return "Only TXT, PDF and CSV files can be added to the knowledge base", None, False
+
+        existing = self.registered_document(group, digest)
+        if existing:
+            return self.duplicate_upload(source, existing, replaces)
+
+        # PDF pages are extracted lazily, so parsing is timed as the segments are consumed
+        segments = timed(file_result['segments'], "parse")
+        if progress:
+            segments = report_progress(segments, lambda n: progress(pages_parsed=n))
+        batches = embed_batches(self.embeddings, split_segments(segments, source))
+        if progress:
+            batches = report_progress(batches, lambda n: progress(chunks_embedded=n), size=lambda batch: len(batch[0]))
+
+        registered = {}
+
+        def register(chunk_ids):
+            # Checked again under the knowledge base's write lock: identical uploads
+            # embedded at the same time, e.g. a double submit, are registered once
+            registered["existing"] = self.registered_document(group, digest)
+            if registered["existing"]:
+                return False
+            registered["document"] = KnowledgeDocument.objects.create(
+                source=source, content_hash=digest or "", group=group, chunk_ids=chunk_ids,
+            )
+            return True
+
+        try:
+            chunk_ids = self.knowledge_base(group).ingest(batches, register=register)
+        except Exception:
+            if registered.get("document"):
+                registered["document"].delete()
+            raise
+        if registered.get("existing"):
+            return self.duplicate_upload(source, registered["existing"], replaces)
+        if not chunk_ids:
+            return "No text found in the uploaded file", None, False
+
+        if replaces is not None:
+            self.delete_document(replaces)
+        return "Uploaded to local knowledge base successfully", registered["document"], False
+
+    def registered_document(self, group, digest):
+        """The KnowledgeDocument of group with content hash digest, or None."""
+        if not digest:
+            return None
+        return KnowledgeDocument.objects.filter(group=group, content_hash=digest).first()
+
+    def duplicate_upload(self, source, existing, replaces=None):
+        if replaces is not None and replaces != existing.id:
+            self.delete_document(replaces)
+        return f"{source} is already in the knowledge base (document {existing.id})", existing, True
+
+    def delete_document(self, document_id):
+        """Remove a KnowledgeDocument and tombstone its chunks. Returns False if it does not exist."""
+        document = KnowledgeDocument.objects.filter(pk=document_id).first()
+        if document is None:
+            return False
+        self.knowledge_base(document.group).delete(document.chunk_ids)
+        document.delete()
+        return True
+
+    def extract_text_from_chat_history(self, chat_history):
+        """
+        Extract all text content from ChatMessageHistory or a list of messages.
+        """
+        extracted_texts = []
+
+        # Check if input is a ChatMessageHistory instance
+        if hasattr(chat_history, 'messages'):
+            messages = chat_history.messages
+        elif isinstance(chat_history, list):  # Handle direct list input
+            messages = chat_history
+        else:
+            raise ValueError("Invalid input: Expected ChatMessageHistory or list of messages.")
+
+        # Extract text from each message
+        for message in messages:
+            if isinstance(message, (HumanMessage, AIMessage, SystemMessage)):
+                if isinstance(message.content, list):
+                    # Extract 'text' field from each dictionary in content
+                    for item in message.content:
+                        if isinstance(item, dict) and 'text' in item:
+                            extracted_texts.append(item['text'])
+                elif isinstance(message.content, str):
+                    # Directly append if content is a string
+                    extracted_texts.append(message.content)
+
+        return '\n'.join(extracted_texts)
+
+    def llm_semaphore(self):
+        # asyncio primitives belong to one event loop, so keep one limit per loop
+        loop = asyncio.get_running_loop()
+        semaphore = self._llm_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+            self._llm_semaphores[loop] = semaphore
+        return semaphore
+
+    async def aanswer(self, question, conversation_id=None, group=None):
+        """
+        Async counterpart of answer() for questions, used by the ASGI chat view.
+
+        Embedding, retrieval and the model call are awaited, so a worker is not
+        pinned while the provider responds. At most LLM_MAX_CONCURRENCY model
+        calls run at once per event loop.
+        """
+        humanMsgs = HumanMessage(content=[self.set_human_msg(question)])
+        chat_history = await sync_to_async(self.conversations.load)(conversation_id)
+
+        try:
+            hits = self.relevant(await self.knowledge_base(group).asearch(
+                self.retrieval_query(question, chat_history), settings.RAG_TOP_K))
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("Searching the knowledge base failed: %s", e)
+            hits = []
+
+        with span("prompt"):
+            system_message = await sync_to_async(self.system_message)()
+            prompt = assemble_prompt(system_message, chat_history, humanMsgs, hits)
+        estimate = self.estimate_tokens(prompt)
+        await llm_scheduler.aacquire(estimate)
+        async with self.llm_semaphore():
+            with span("llm"):
+                response = await self.chatmodel.ainvoke(prompt)
+        llm_scheduler.settle(estimate, self.record_usage(prompt, response))
+
+        await sync_to_async(self.remember)(conversation_id, chat_history, humanMsgs, response.content)
+        return response.content
+
+    def relevant(self, hits):
+        return [(document, score) for document, score in hits if score >= settings.RAG_RELEVANCE_THRESHOLD]
+
+    def search_from_knowledge_base(self, question, group=None):
+        """
+        Return the (document, relevance score) hits for a question, or a list of
+        messages, that clear RAG_RELEVANCE_THRESHOLD. Empty when nothing is relevant.
+        """
+        if not isinstance(question, str):
+            question = self.extract_text_from_chat_history(question)
+            # raise ValueError("Input question must be a string.")
+
+        return self.relevant(self.knowledge_base(group).search(question, settings.RAG_TOP_K))
+
+    def retrieval_query(self, question, chat_history):
+        """
+        The text embedded to search the knowledge base: the question alone, or
+        with RAG_QUERY_PREVIOUS_TURN the previous question before it, so that
+        follow-ups such as "and on Windows?" still find their subject.
+        """
+        if settings.RAG_QUERY_PREVIOUS_TURN:
+            previous = [message for message in chat_history if isinstance(message, HumanMessage)][-1:]
+            if previous:
+                return self.extract_text_from_chat_history(previous) + "\n" + question
+        return question
+
+    def prepare_stream(self, question, conversation_id=None, group=None):
+        """
+        Everything a streamed answer needs before its first token: the
+        conversation history, the relevant knowledge base chunks, the prompt,
+        and admission of the model call by llm_scheduler. Runs before the
+        response starts, so Rejected can still be answered with 429 or 503.
+        """
+        humanMsgs = HumanMessage(content=[self.set_human_msg(question)])
+        chat_history = self.conversations.load(conversation_id)
+
+        try:
+            hits = self.search_from_knowledge_base(self.retrieval_query(question, chat_history), group)
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("Searching the knowledge base failed: %s", e)
+            hits = []
+
+        with span("prompt"):
+            prompt = assemble_prompt(self.system_message(), chat_history, humanMsgs, hits)
+        estimate = self.estimate_tokens(prompt)
+        llm_scheduler.acquire(estimate)
+        return PreparedAnswer(conversation_id, chat_history, humanMsgs, prompt, estimate)
+
+    def stream_answer(self, prepared):
+        """
+        Yield the answer to a question prepared by prepare_stream() token by
+        token as the model produces it. The full answer is added to the
+        conversation at the end.
+        """
+        tokens = []
+        with span("llm"):
+            for chunk in self.chatmodel.stream(prepared.prompt):
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield chunk.content
+        answer = "".join(tokens)
+        llm_scheduler.settle(prepared.estimate, self.record_usage(prepared.prompt, AIMessage(content=answer)))
+
+        self.remember(prepared.conversation_id, prepared.chat_history, prepared.human_message, answer)
+
+    async def astream_answer(self, prepared):
+        """
+        Async counterpart of stream_answer(), for streaming under ASGI: the
+        response is consumed on the event loop, so the model is awaited and
+        the conversation is saved in a thread.
+        """
+        tokens = []
+        async with self.llm_semaphore():
+            with span("llm"):
+                async for chunk in self.chatmodel.astream(prepared.prompt):
+                    if chunk.content:
+                        tokens.append(chunk.content)
+                        yield chunk.content
+        answer = "".join(tokens)
+        llm_scheduler.settle(prepared.estimate, self.record_usage(prepared.prompt, AIMessage(content=answer)))
+
+        await sync_to_async(self.remember)(
+            prepared.conversation_id, prepared.chat_history, prepared.human_message, answer)
+
+
+def warm_up():
+    """
+    Do the work the first requests of a worker would otherwise pay for: create
+    the chat bot and its model clients, load the admin prompts and the
+    tokenizer, and open every knowledge base on disk, reading its segment
+    files into the page cache. Returns the seconds each step took.
+    """
+    timings = {}
+
+    def step(name, function):
+        started = time.perf_counter()
+        result = function()
+        timings[name] = round(time.perf_counter() - started, 3)
+        return result
+
+    bot = step("chat_bot", ChatBot)
+    step("prompts", bot.system_message)
+    step("tokenizer", lambda: count_tokens("warm up"))
+    groups = [None]
+    groups_dir = os.path.join(settings.KNOWLEDGE_BASE_DIR, "groups")
+    if os.path.isdir(groups_dir):
+        groups.extend(sorted(int(name) for name in os.listdir(groups_dir) if name.isdigit()))
+    step("knowledge_bases", lambda: [bot.knowledge_base(group).preload() for group in groups])
+    return timings
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def warm_up_in_background():
+    """
+    Start warm_up() in a background thread unless it is already running or
+    done, and return its Future. A failed warm-up is retried on the next call.
+    """
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None or (_warmup.done() and _warmup.exception()):
+            _warmup = Future()
+            threading.Thread(target=_run_warm_up, args=(_warmup,), name="warmup", daemon=True).start()
+        return _warmup
+
+
+def _run_warm_up(future):
+    try:
+        future.set_result(warm_up())
+        # Take over the uploads an earlier process left queued or running
+        start_lease_keeper()
+    except Exception as e:
+        logger.error("Chat bot warm-up failed: %s", e)
+        future.set_exception(e)
+    finally:
+        connections.close_all()
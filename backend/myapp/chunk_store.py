@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+from langchain.schema import Document
+
+from .lexical import tokenize
+
+
+class ChunkStore:
+    """
+    Text and metadata of the chunks in one knowledge base snapshot, kept in a
+    SQLite file and addressed by their position in the FAISS index.
+
+    The file also holds the BM25 postings of the chunks' text. Rows and
+    postings are read on demand, so worker processes share the file through the
+    OS page cache instead of each holding a pickled copy of every chunk.
+    """
+
+    FILE_NAME = "chunks.sqlite3"
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILE_NAME)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        self._local = threading.local()
+        self._stats = None
+        self.has_postings = self._connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'postings'").fetchone() is not None
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def append(cls, directory, rows):
+        """
+        Write (position, doc_id, text, metadata) rows and the postings of their
+        text into the store in directory, creating it if needed.
+        """
+        conn = sqlite3.connect(os.path.join(directory, cls.FILE_NAME))
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS chunks (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE, "
+                    "text TEXT NOT NULL, metadata TEXT NOT NULL, length INTEGER NOT NULL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, position INTEGER NOT NULL, "
+                    "frequency INTEGER NOT NULL, PRIMARY KEY (term, position)) WITHOUT ROWID"
+                )
+                for position, doc_id, text, metadata in rows:
+                    tokens = tokenize(text)
+                    conn.execute(
+                        "INSERT INTO chunks (position, doc_id, text, metadata, length) VALUES (?, ?, ?, ?, ?)",
+                        (position, doc_id, text, json.dumps(metadata), len(tokens)),
+                    )
+                    conn.executemany(
+                        "INSERT INTO postings (term, position, frequency) VALUES (?, ?, ?)",
+                        ((term, position, frequency) for term, frequency in Counter(tokens).items()),
+                    )
+        finally:
+            conn.close()
+
+    def _select(self, column, values):
+        values = list(values)
+        found = {}
+        for start in range(0, len(values), 500):
+            batch = values[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT position, doc_id, text, metadata FROM chunks WHERE {column} IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            for position, doc_id, text, metadata in rows:
+                found[position if column == "position" else doc_id] = (
+                    position, Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+                )
+        return found
+
+    def by_position(self, positions):
+        """Return {position: Document} for the given index positions."""
+        return {key: document for key, (_, document) in self._select("position", positions).items()}
+
+    def by_id(self, doc_ids):
+        """Return {doc_id: Document} for the given chunk ids."""
+        return {key: document for key, (_, document) in self._select("doc_id", doc_ids).items()}
+
+    def present(self, doc_ids):
+        """The subset of doc_ids stored here."""
+        doc_ids = list(doc_ids)
+        found = set()
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            found.update(doc_id for doc_id, in self._connection().execute(
+                f"SELECT doc_id FROM chunks WHERE doc_id IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def lexical_stats(self):
+        """(number of chunks, total tokens) for BM25 length normalization."""
+        if self._stats is None:
+            count, total = self._connection().execute("SELECT COUNT(*), SUM(length) FROM chunks").fetchone()
+            self._stats = (count, total or 0)
+        return self._stats
+
+    def postings(self, terms):
+        """Return {term: [(doc_id, term frequency, chunk length)]} for the given terms."""
+        terms = list(terms)
+        found = {}
+        rows = self._connection().execute(
+            "SELECT postings.term, chunks.doc_id, postings.frequency, chunks.length FROM postings "
+            f"JOIN chunks ON chunks.position = postings.position WHERE postings.term IN ({','.join('?' * len(terms))})",
+            terms,
+        )
+        for term, doc_id, frequency, length in rows:
+            found.setdefault(term, []).append((doc_id, frequency, length))
+        return found
+
+    def has_term(self, term):
+        return self._connection().execute("SELECT 1 FROM postings WHERE term = ? LIMIT 1", (term,)).fetchone() is not None
+
+    def ids(self):
+        """Every chunk id, in position order."""
+        return [doc_id for doc_id, in self._connection().execute("SELECT doc_id FROM chunks ORDER BY position")]
+
+    def rows(self):
+        """Yield every (position, doc_id, text, metadata) row in position order."""
+        cursor = self._connection().execute("SELECT position, doc_id, text, metadata FROM chunks ORDER BY position")
+        for position, doc_id, text, metadata in cursor:
+            yield position, doc_id, text, json.loads(metadata)
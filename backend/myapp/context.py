@@ -0,0 +1,51 @@
+from django.conf import settings
+from langchain_core.messages import AIMessage, SystemMessage
+
+from .tokens import count_tokens, message_tokens
+
+RAG_CONTEXT_PROMPT = """Use the following pieces of context to answer the user's question. \
+If you don't know the answer, just say that you don't know, don't try to make up an answer.
+----------------
+{context}"""
+CHUNK_SEPARATOR = "\n\n"
+
+
+def assemble_prompt(system_message, history, question, hits, budget=None):
+    """
+    Build the messages for one model call within budget tokens, counted locally.
+
+    The system prefix and the question are always sent. The rest of the budget
+    goes first to the retrieved chunks, best score first, and then to the most
+    recent turns of the history. Chunks are only ever dropped whole, from the
+    lowest scoring one up, and history is dropped from the oldest message up.
+    """
+    budget = settings.PROMPT_TOKEN_BUDGET if budget is None else budget
+    remaining = budget - message_tokens(system_message) - message_tokens(question)
+
+    chunks = []
+    if hits:
+        header = message_tokens(SystemMessage(content=RAG_CONTEXT_PROMPT.format(context="")))
+        for document, _ in sorted(hits, key=lambda hit: hit[1], reverse=True):
+            cost = count_tokens(document.page_content + CHUNK_SEPARATOR) + (0 if chunks else header)
+            if cost > remaining:
+                break
+            chunks.append(document.page_content)
+            remaining -= cost
+
+    turns = []
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        turns.append(message)
+        remaining -= cost
+    turns.reverse()
+    # An answer without the question it answered only confuses the model
+    while turns and isinstance(turns[0], AIMessage):
+        turns.pop(0)
+
+    messages = [system_message, *turns]
+    if chunks:
+        messages.append(SystemMessage(content=RAG_CONTEXT_PROMPT.format(context=CHUNK_SEPARATOR.join(chunks))))
+    messages.append(question)
+    return messages
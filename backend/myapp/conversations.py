@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from .tokens import message_tokens
+
+
+class ConversationStore:
+    """
+    Message history per conversation id, kept in the "conversations" cache.
+
+    Each conversation keeps only its most recent messages that fit in
+    CONVERSATION_TOKEN_WINDOW tokens, so prompt size stays flat however long
+    the conversation or the process runs. Requests without a conversation id
+    get no history at all.
+    """
+
+    KEY_PREFIX = "conversation:"
+
+    def __init__(self, token_window=None):
+        self.token_window = settings.CONVERSATION_TOKEN_WINDOW if token_window is None else token_window
+        self.cache = caches["conversations"]
+
+    def load(self, conversation_id):
+        if not conversation_id:
+            return []
+        return list(self.cache.get(self.KEY_PREFIX + conversation_id, []))
+
+    def save(self, conversation_id, messages):
+        if not conversation_id:
+            return
+        self.cache.set(self.KEY_PREFIX + conversation_id, self.trim(messages))
+
+    def trim(self, messages):
+        # Evict the oldest messages until the rest fit in the token window
+        kept, total = [], 0
+        for message in reversed(messages):
+            total += message_tokens(message)
+            if kept and total > self.token_window:
+                break
+            kept.append(message)
+        kept.reverse()
+        return kept
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+from .metrics import record_cache
+from .tokens import count_tokens
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by a content-addressed SQLite cache on local disk.
+
+    Vectors are keyed by a hash of (model, text), so re-uploading a document or
+    repeating a question costs no embedding calls. The cache holds at most
+    max_entries vectors and evicts the least recently used ones beyond that.
+    Provider calls for cache misses are admitted through scheduler, if given.
+    """
+
+    def __init__(self, underlying, model, path=None, max_entries=None, scheduler=None):
+        self.underlying = underlying
+        self.model = model
+        self.scheduler = scheduler
+        self.path = str(path or settings.EMBEDDING_CACHE_PATH)
+        self.max_entries = settings.EMBEDDING_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        conn = self._connection()
+        found = {}
+        unique = list(set(keys))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+        return found
+
+    def _store(self, entries):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in entries.items()],
+            )
+            (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if self.max_entries and count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def _missing(self, keys, texts, found):
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        record_cache("embedding", hits=len(texts) - len(missing), misses=len(missing))
+        return missing
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            if self.scheduler:
+                self.scheduler.acquire(sum(count_tokens(text) for text in missing.values()))
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        # Cache reads and writes are local disk I/O; only the provider call is awaited natively
+        keys = [self._key(text) for text in texts]
+        found = await sync_to_async(self._lookup, thread_sensitive=False)(keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            if self.scheduler:
+                await self.scheduler.aacquire(sum(count_tokens(text) for text in missing.values()))
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            await sync_to_async(self._store, thread_sensitive=False)(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,185 @@
+import contextvars
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+
+from .metrics import span
+
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def pdf_executor():
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            # Forking a worker that runs request, ingestion and compaction threads can copy a lock
+            # another thread holds, e.g. the import lock, and deadlock the child. Start clean processes.
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pdf_executor = ProcessPoolExecutor(max_workers=settings.PDF_EXTRACTION_WORKERS or None,
+                                                mp_context=multiprocessing.get_context(start_method))
+        return _pdf_executor
+
+
+def extract_pdf_pages(path, first_page, last_page):
+    """Extract the text of pages first_page..last_page (1-based). Runs in a worker process."""
+    # pdfplumber and LangChain are imported on use, so the views can hash uploads without loading them
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for page_number in range(first_page, last_page + 1):
+            page = pdf.pages[page_number - 1]
+            pages.append((page.extract_text() or "", {"page": page_number}))
+            # Drop the parsed page objects so the worker only ever holds a few pages
+            page.close()
+    return pages
+
+
+def iter_pdf_pages(path):
+    """
+    Yield (text, {"page": n}) for every page of a PDF, in page order.
+
+    Page ranges are extracted in a process pool. Only a bounded window of
+    ranges is in flight, so memory stays proportional to a few pages while
+    wall time scales with the number of cores.
+    """
+    import pdfplumber
+
+    with pdfplumber.open(path) as pdf:
+        page_count = len(pdf.pages)
+
+    executor = pdf_executor()
+    pages_per_task = settings.PDF_PAGES_PER_TASK
+    window = (settings.PDF_EXTRACTION_WORKERS or os.cpu_count() or 1) * 2
+    pending = deque()
+    for first_page in range(1, page_count + 1, pages_per_task):
+        last_page = min(first_page + pages_per_task - 1, page_count)
+        pending.append(executor.submit(extract_pdf_pages, path, first_page, last_page))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def iter_uploaded_pdf(upload_file):
+    """Stream an uploaded PDF from disk, spooling in-memory uploads to a temp file first."""
+    if hasattr(upload_file, "temporary_file_path"):
+        yield from iter_pdf_pages(upload_file.temporary_file_path())
+        return
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            upload_file.seek(0)
+            shutil.copyfileobj(upload_file, f)
+        yield from iter_pdf_pages(path)
+    finally:
+        os.remove(path)
+
+
+INGESTIBLE_EXTENSIONS = ("txt", "pdf", "csv")
+
+
+def is_ingestible(file_name):
+    """True for the file types that can be added to the knowledge base."""
+    return file_name.split(".")[-1].lower() in INGESTIBLE_EXTENSIONS
+
+
+def content_hash(upload_file):
+    """sha256 of an uploaded file's contents, leaving the file rewound for the next reader."""
+    digest = hashlib.sha256()
+    for chunk in upload_file.chunks():
+        digest.update(chunk)
+    upload_file.seek(0)
+    return digest.hexdigest()
+
+
+def split_segments(segments, source):
+    """
+    Split (text, metadata) segments into overlapping chunks.
+
+    Each chunk carries the source file name, the metadata of the segment it
+    came from (page number or row range) and its position in the document.
+    """
+    from langchain.schema import Document
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.INGESTION_CHUNK_SIZE,
+        chunk_overlap=settings.INGESTION_CHUNK_OVERLAP,
+    )
+    position = 0
+    for text, metadata in segments:
+        for piece in splitter.split_text(text):
+            yield Document(page_content=piece, metadata={"source": source, **metadata, "chunk": position})
+            position += 1
+
+
+def report_progress(items, callback, size=lambda item: 1):
+    """Pass items through, calling callback(total) once each one has been consumed."""
+    total = 0
+    for item in items:
+        yield item
+        total += size(item)
+        callback(total)
+
+
+def timed(items, stage):
+    """Pass items through, timing how long each one takes to produce as a pipeline stage."""
+    iterator = iter(items)
+    while True:
+        with span(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def embed_batches(embeddings, documents):
+    """
+    Embed documents in batches, several batches in flight at once.
+
+    Yields (texts, vectors, metadatas) per batch in document order. At most
+    EMBEDDING_MAX_WORKERS * 2 batches are pending, so long documents are never
+    held in memory all at once.
+    """
+    max_workers = settings.EMBEDDING_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for batch in batched(documents, settings.EMBEDDING_BATCH_SIZE):
+            texts = [doc.page_content for doc in batch]
+            # Each batch runs in a copy of the caller's context, so it keeps the job's scheduling priority
+            pending.append((texts, [doc.metadata for doc in batch],
+                            executor.submit(contextvars.copy_context().run, embeddings.embed_documents, texts)))
+            if len(pending) >= max_workers * 2:
+                texts, metadatas, future = pending.popleft()
+                yield texts, wait_for_embeddings(future), metadatas
+        while pending:
+            texts, metadatas, future = pending.popleft()
+            yield texts, wait_for_embeddings(future), metadatas
+
+
+def wait_for_embeddings(future):
+    # Only the wait is timed: batches are embedded in parallel with parsing and with each other
+    with span("embedding"):
+        return future.result()
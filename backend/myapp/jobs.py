@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .ingestion import content_hash
+from .metrics import span
+from .models import IngestionJob
+from .scheduler import INGESTION, priority
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_held = set()  # ids of the jobs this process has queued or is running
+_held_lock = threading.Lock()
+_keeper = None
+
+
+def ingestion_executor():
+    # A pool of its own, so chat requests never wait behind ingestion work
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS,
+                                           thread_name_prefix="ingestion")
+        return _executor
+
+
+class StoredUpload(File):
+    """A persisted upload, exposing its path the way Django's TemporaryUploadedFile does."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def enqueue_upload(upload_file, group=None, replaces=None, digest=None):
+    """
+    Persist an uploaded file, queue it for ingestion into group's knowledge base
+    and return its IngestionJob. replaces is the id of a KnowledgeDocument the
+    upload supersedes.
+    """
+    digest = digest or content_hash(upload_file)
+    storage = FileSystemStorage(location=settings.INGESTION_UPLOAD_DIR)
+    stored_name = storage.save(upload_file.name, upload_file)
+    job = IngestionJob.objects.create(file_name=upload_file.name, file_path=storage.path(stored_name), group=group,
+                                      content_hash=digest, replaces=replaces, heartbeat_at=timezone.now())
+    submit(job.id)
+    return job
+
+
+def submit(job_id):
+    """Queue a job on this process's ingestion pool and keep its lease renewed until it finishes."""
+    with _held_lock:
+        _held.add(job_id)
+    start_lease_keeper()
+    ingestion_executor().submit(run_ingestion, job_id)
+
+
+def start_lease_keeper():
+    """
+    Start the thread that renews the leases of this process's jobs and takes
+    over the jobs other processes stopped renewing, unless it is running.
+    """
+    global _keeper
+    with _held_lock:
+        if _keeper is None:
+            _keeper = threading.Thread(target=_keep_leases, name="ingestion-leases", daemon=True)
+            _keeper.start()
+
+
+def _keep_leases():
+    while True:
+        try:
+            with _held_lock:
+                held = list(_held)
+            if held:
+                IngestionJob.objects.filter(pk__in=held).update(heartbeat_at=timezone.now())
+            recover_jobs()
+        except Exception as e:
+            logger.warning("Renewing ingestion job leases failed: %s", e)
+        finally:
+            close_old_connections()
+        time.sleep(settings.INGESTION_JOB_LEASE / 3)
+
+
+def recover_jobs():
+    """
+    Take over queued and running jobs whose lease expired, e.g. because their
+    process restarted: they are queued again here, or failed when their
+    uploaded file is gone. Returns the ids of the jobs queued again.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.INGESTION_JOB_LEASE)
+    stale = IngestionJob.objects.filter(status__in=[IngestionJob.QUEUED, IngestionJob.RUNNING]).filter(
+        Q(heartbeat_at__lt=expired) | Q(heartbeat_at__isnull=True))
+    recovered = []
+    for job in stale:
+        # Only one process wins the claim when several see the job at once
+        claimed = IngestionJob.objects.filter(pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at).update(
+            status=IngestionJob.QUEUED, heartbeat_at=now)
+        if not claimed:
+            continue
+        if not os.path.exists(job.file_path):
+            IngestionJob.objects.filter(pk=job.pk).update(
+                status=IngestionJob.FAILED, message="The uploaded file was lost in a restart; upload it again")
+            continue
+        logger.info("Ingestion job %s was interrupted, queuing it again", job.pk)
+        submit(job.pk)
+        recovered.append(job.pk)
+    return recovered
+
+
+class JobProgress:
+    """Collects the progress counts of a job, writing them to the database at most once a second."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.counts = {}
+        self._written_at = 0.0
+
+    def __call__(self, **counts):
+        self.counts.update(counts)
+        now = time.monotonic()
+        if now - self._written_at >= 1:
+            IngestionJob.objects.filter(pk=self.job_id).update(**self.counts)
+            self._written_at = now
+
+
+def run_ingestion(job_id):
+    close_old_connections()
+    try:
+        _run_ingestion(job_id)
+    finally:
+        with _held_lock:
+            _held.discard(job_id)
+        close_old_connections()
+
+
+def _run_ingestion(job_id):
+    job = IngestionJob.objects.get(pk=job_id)
+    IngestionJob.objects.filter(pk=job_id).update(status=IngestionJob.RUNNING, heartbeat_at=timezone.now())
+    progress = JobProgress(job_id)
+
+    from .chatbot import ChatBot
+
+    bot = ChatBot()
+    try:
+        with open(job.file_path, 'rb') as f, priority(INGESTION):
+            upload_file = StoredUpload(f, name=job.file_name)
+            with span("parse"):
+                file_result = bot.process_upload_files(upload_file)
+            message, document, duplicate = bot.update_knowledge_base(
+                file_result, job.file_name, progress=progress, group=job.group, digest=job.content_hash,
+                replaces=job.replaces,
+            )
+        IngestionJob.objects.filter(pk=job_id).update(
+            status=IngestionJob.DUPLICATE if duplicate else IngestionJob.DONE, message=message,
+            document=document.id if document else None,
+            index_version=bot.knowledge_base(job.group).version or "", **progress.counts,
+        )
+    except Exception as e:
+        logger.error("Ingestion job %s failed: %s", job_id, e)
+        IngestionJob.objects.filter(pk=job_id).update(status=IngestionJob.FAILED, message=str(e))
+    finally:
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
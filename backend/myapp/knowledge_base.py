@@ -0,0 +1,638 @@
+import fcntl
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ann import index_vectors, migrate_to_ann, read_index, wants_ann
+from .chunk_store import ChunkStore
+from .lexical import LexicalIndex, identifier_term, identifier_terms, search_indexes
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+_compaction_executor = None
+_compaction_executor_lock = threading.Lock()
+
+
+def compaction_executor():
+    # A single background thread, so compaction never competes with itself for CPU
+    global _compaction_executor
+    with _compaction_executor_lock:
+        if _compaction_executor is None:
+            _compaction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compaction")
+        return _compaction_executor
+
+
+class Segment:
+    """An immutable part of a knowledge base: FAISS index and chunk store with its postings, opened for serving."""
+
+    INDEX_FILE = "index.faiss"
+    VECTORS_FILE = "vectors.npy"
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        self.path = path
+        self.chunks = ChunkStore(path)
+        self.index = read_index(os.path.join(path, self.INDEX_FILE), mmap=settings.KNOWLEDGE_BASE_MMAP)
+        # Segments written before the postings moved into the chunk store load theirs into memory
+        self.legacy = not self.chunks.has_postings
+        self.lexical = (LexicalIndex.load(path) or LexicalIndex()) if self.legacy else self.chunks
+
+    def vectors(self):
+        """
+        The exact vectors of the chunks, in position order, memory mapped.
+        Segments written before vectors.npy existed reconstruct them from the
+        index, which is approximate for IVF-PQ.
+        """
+        path = os.path.join(self.path, self.VECTORS_FILE)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r")
+        # Read a private copy, the served index is memory mapped read-only
+        return index_vectors(read_index(os.path.join(self.path, self.INDEX_FILE)))
+
+
+class Snapshot:
+    """
+    The segments listed by one published manifest, and the ids of chunks
+    deleted from them. revision names the chunks it serves, which compaction
+    keeps the same.
+    """
+
+    def __init__(self, segments, deleted, revision):
+        self.segments = segments
+        self.deleted = deleted
+        self.revision = revision
+        self.deleted_counts = {segment.name: len(segment.chunks.present(deleted)) if deleted else 0
+                               for segment in segments}
+
+    def live_chunks(self, segment):
+        return segment.index.ntotal - self.deleted_counts[segment.name]
+
+
+class KnowledgeBase:
+    """
+    Long-lived holder for the FAISS knowledge base and its lexical index.
+
+    The knowledge base is a list of immutable segments under segments/. Each
+    ingestion writes one new segment holding only its own chunks, then
+    publishes a new snapshot: a manifest under snapshots/ listing the live
+    segments, which the CURRENT file is atomically repointed at. Writers
+    serialize on a file lock, so concurrent uploads from several worker
+    processes never drop each other's chunks, and readers only ever open
+    published segments. Searches fan out across segments and merge the
+    results, while a background compaction merges segments of similar size so
+    their number stays logarithmic in the number of chunks.
+
+    Deleting chunks only records their ids in the manifest as tombstones,
+    which searches filter out. Compaction drops them for good once enough of
+    a segment is deleted.
+
+    Segment indexes are memory mapped read-only and chunks are read from
+    SQLite on demand, so the worker processes on a host share one page-cached
+    copy of both.
+    """
+
+    CURRENT_FILE = "CURRENT"
+    LOCK_FILE = ".lock"
+    SNAPSHOT_DIR = "snapshots"
+    SEGMENT_DIR = "segments"
+
+    def __init__(self, embeddings, index_path=None):
+        self.embeddings = embeddings
+        self.index_path = str(index_path or settings.KNOWLEDGE_BASE_DIR)
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._segments = {}  # name -> open Segment, reused across snapshots
+        self._snapshot = None
+        self._version = None
+
+    def _disk_version(self):
+        try:
+            with open(os.path.join(self.index_path, self.CURRENT_FILE)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+        # Indexes saved before snapshots existed live directly in index_path
+        if os.path.exists(os.path.join(self.index_path, Segment.INDEX_FILE)):
+            return ""
+        return None
+
+    def _manifest_path(self, version):
+        return os.path.join(self.index_path, self.SNAPSHOT_DIR, f"{version}.json")
+
+    def _segment_path(self, name):
+        return os.path.join(self.index_path, self.SEGMENT_DIR, name)
+
+    def _is_legacy(self, version):
+        return version is not None and not os.path.exists(self._manifest_path(version))
+
+    def _read_manifest(self, version):
+        """Return the (segment names, deleted chunk ids) of a snapshot."""
+        if version is None:
+            return [], set()
+        with open(self._manifest_path(version)) as f:
+            manifest = json.load(f)
+        return manifest["segments"], set(manifest.get("deleted", ()))
+
+    def _read_revision(self, version):
+        # Manifests written before revisions existed are their own revision
+        with open(self._manifest_path(version)) as f:
+            return json.load(f).get("revision", version)
+
+    def _open(self, version):
+        if version is None:
+            return None
+        names, deleted = self._read_manifest(version)
+        segments = [self._segments.get(name) or Segment(self._segment_path(name)) for name in names]
+        self._segments = {segment.name: segment for segment in segments}
+        logger.debug("Opened knowledge base version %s with %d segments", version, len(segments))
+        return Snapshot(segments, deleted, self._read_revision(version))
+
+    def _current(self):
+        with self._lock:
+            version = self._disk_version()
+            if version == self._version:
+                return self._snapshot
+        if self._is_legacy(version):
+            self._upgrade()
+        with self._lock:
+            version = self._disk_version()
+            if version != self._version:
+                try:
+                    snapshot = self._open(version)
+                except FileNotFoundError:
+                    # The snapshot was superseded and collected between reading CURRENT and opening it
+                    version = self._disk_version()
+                    snapshot = self._open(version)
+                self._snapshot, self._version = snapshot, version
+            return self._snapshot
+
+    def _upgrade(self):
+        """
+        Turn an index saved in an older layout into the first segment: a
+        snapshot directory with a chunk store, or an index saved by LangChain's
+        FAISS store (index.faiss plus a pickled docstore).
+        """
+        with self._write_lock, self._file_lock():
+            version = self._disk_version()
+            if not self._is_legacy(version):
+                return
+            path = os.path.join(self.index_path, self.SNAPSHOT_DIR, version) if version else self.index_path
+            logger.info("Converting FAISS index (version %s) to a segment", version or "legacy")
+            if os.path.exists(os.path.join(path, ChunkStore.FILE_NAME)):
+                name = self._link_segment(path)
+            else:
+                from langchain.vectorstores import FAISS
+
+                store = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+                rows = []
+                for position in range(store.index.ntotal):
+                    doc_id = store.index_to_docstore_id[position]
+                    document = store.docstore.search(doc_id)
+                    rows.append((position, doc_id, document.page_content, document.metadata))
+                name = self._write_segment(index_vectors(store.index), rows, index=store.index)
+            self._publish([name])
+
+    def _link_segment(self, path):
+        # Snapshot files are immutable, so hard links are as good as a copy
+        name = self._new_name()
+        staging = self._segment_path(f".tmp-{name}")
+        os.makedirs(staging)
+        for file_name in (Segment.INDEX_FILE, Segment.VECTORS_FILE, ChunkStore.FILE_NAME, LexicalIndex.FILE_NAME):
+            if os.path.exists(os.path.join(path, file_name)):
+                try:
+                    os.link(os.path.join(path, file_name), os.path.join(staging, file_name))
+                except OSError:
+                    shutil.copyfile(os.path.join(path, file_name), os.path.join(staging, file_name))
+        os.rename(staging, self._segment_path(name))
+        return name
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, self.LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _vector_scores(self, snapshot, vectors, k):
+        """
+        One {doc_id: (document, score)} dict of the k nearest chunks per query
+        vector. Each segment is searched once for all the queries together.
+        """
+        queries = np.asarray(vectors, dtype=np.float32)
+        hits = [{} for _ in queries]
+        for segment in snapshot.segments:
+            if snapshot.live_chunks(segment) == 0:
+                continue
+            # Ask for enough extra neighbours to make up for deleted chunks
+            distances, positions = segment.index.search(queries, k + snapshot.deleted_counts[segment.name])
+            # The index returns squared L2 distances; for unit vectors, as OpenAI embeddings
+            # are, cosine similarity is 1 - d^2 / 2
+            scores = [
+                {int(position): 1.0 - distance / 2.0
+                 for distance, position in zip(row_distances, row_positions) if position != -1}
+                for row_distances, row_positions in zip(distances, positions)
+            ]
+            documents = segment.chunks.by_position(set().union(*scores))
+            for query_hits, query_scores in zip(hits, scores):
+                for position, score in query_scores.items():
+                    document = documents[position]
+                    if document.id not in snapshot.deleted:
+                        query_hits[document.id] = (document, score)
+        return [dict(sorted(query_hits.items(), key=lambda item: item[1][1], reverse=True)[:k]) for query_hits in hits]
+
+    def _documents(self, segments, doc_ids):
+        documents = {}
+        missing = set(doc_ids)
+        for segment in segments:
+            if not missing:
+                break
+            found = segment.chunks.by_id(missing)
+            documents.update(found)
+            missing.difference_update(found)
+        return documents
+
+    def _lexical_scores(self, snapshot, query, k):
+        hits = search_indexes([segment.lexical for segment in snapshot.segments], query, k + len(snapshot.deleted))
+        return [(doc_id, score) for doc_id, score in hits if doc_id not in snapshot.deleted][:k]
+
+    def _retrieve(self, snapshot, queries, vectors, k):
+        candidates = k * 4
+        return [self._fuse(snapshot, query, vector_hits, candidates, k)
+                for query, vector_hits in zip(queries, self._vector_scores(snapshot, vectors, candidates))]
+
+    def _fuse(self, snapshot, query, vector_hits, candidates, k):
+        """
+        Combine vector and BM25 scores. Lexical matches only raise a chunk's score
+        towards 1, so chunks without any keep their plain vector relevance.
+        Chunks naming every identifier in the query score 1, ahead of the rest,
+        even when the vector search missed them.
+        """
+        lexical_scores = dict(self._lexical_scores(snapshot, query, candidates))
+        exact = self._identifier_matches(snapshot, identifier_terms(query))[:candidates]
+        weight = settings.KNOWLEDGE_BASE_LEXICAL_WEIGHT
+        fused = {}
+        for doc_id in vector_hits.keys() | lexical_scores.keys() | set(exact):
+            relevance = max(vector_hits[doc_id][1], 0.0) if doc_id in vector_hits else 0.0
+            fused[doc_id] = relevance + (1 - relevance) * weight * lexical_scores.get(doc_id, 0.0)
+        exact = set(exact)
+        ranked = sorted(fused.items(), key=lambda item: (item[0] in exact, item[1]), reverse=True)[:k]
+        documents = self._documents(snapshot.segments, [doc_id for doc_id, _ in ranked if doc_id not in vector_hits])
+        documents.update((doc_id, document) for doc_id, (document, _) in vector_hits.items())
+        return [(documents[doc_id], 1.0 if doc_id in exact else score) for doc_id, score in ranked]
+
+    def _identifier_matches(self, snapshot, terms):
+        """The live chunks containing every one of terms, those naming them most often first."""
+        if not terms:
+            return []
+        frequencies, found = {}, {}
+        for segment in snapshot.segments:
+            for term, matches in segment.lexical.postings(terms).items():
+                for doc_id, frequency, _ in matches:
+                    if doc_id not in snapshot.deleted:
+                        frequencies[doc_id] = frequencies.get(doc_id, 0) + frequency
+                        found.setdefault(doc_id, set()).add(term)
+        doc_ids = [doc_id for doc_id, names in found.items() if len(names) == len(terms)]
+        return sorted(doc_ids, key=lambda doc_id: frequencies[doc_id], reverse=True)
+
+    def is_identifier(self, query):
+        """True when query is a single identifier indexed here, which search() answers without embedding it."""
+        snapshot = self._current()
+        return snapshot is not None and self._has_identifier(snapshot, query)
+
+    def _has_identifier(self, snapshot, query):
+        term = identifier_term(query)
+        return term is not None and any(segment.lexical.has_term(term) for segment in snapshot.segments)
+
+    def _exact(self, snapshot, query, k):
+        # Exact identifiers are answered from the lexical index without an embedding call. The chunks
+        # containing one are what the question asks for, so they score 1 and clear any relevance threshold.
+        term = identifier_term(query)
+        if term is None:
+            return []
+        doc_ids = self._identifier_matches(snapshot, {term})[:k]
+        documents = self._documents(snapshot.segments, doc_ids)
+        return [(documents[doc_id], 1.0) for doc_id in doc_ids]
+
+    def search(self, query, k):
+        """Return up to k (document, relevance score) pairs, scores in [0, 1]; empty without an index."""
+        with span("index_load"):
+            snapshot = self._current()
+        if snapshot is None or not snapshot.segments:
+            return []
+        with span("retrieval"):
+            exact = self._exact(snapshot, query, k)
+        if exact:
+            return exact
+        with span("embedding"):
+            vector = self.embeddings.embed_query(query)
+        with span("retrieval"):
+            return self._retrieve(snapshot, [query], [vector], k)[0]
+
+    async def asearch(self, query, k):
+        # Opening a snapshot reads from disk, keep it off the event loop
+        with span("index_load"):
+            snapshot = await sync_to_async(self._current, thread_sensitive=False)()
+        if snapshot is None or not snapshot.segments:
+            return []
+        with span("retrieval"):
+            exact = await sync_to_async(self._exact, thread_sensitive=False)(snapshot, query, k)
+        if exact:
+            return exact
+        with span("embedding"):
+            vector = await self.embeddings.aembed_query(query)
+        with span("retrieval"):
+            return (await sync_to_async(self._retrieve, thread_sensitive=False)(snapshot, [query], [vector], k))[0]
+
+    def search_many(self, queries, k, vectors=None):
+        """
+        search() for a list of queries, returning one hit list per query. The
+        queries whose vectors are not given (None) are embedded in one call, and
+        every segment is searched once for all of them.
+        """
+        with span("index_load"):
+            snapshot = self._current()
+        if snapshot is None or not snapshot.segments:
+            return [[] for _ in queries]
+        with span("retrieval"):
+            results = [self._exact(snapshot, query, k) for query in queries]
+        pending = [i for i, hits in enumerate(results) if not hits]
+        if not pending:
+            return results
+        pending_vectors = [None if vectors is None else vectors[i] for i in pending]
+        missing = [j for j, vector in enumerate(pending_vectors) if vector is None]
+        if missing:
+            with span("embedding"):
+                embedded = self.embeddings.embed_documents([queries[pending[j]] for j in missing])
+            for j, vector in zip(missing, embedded):
+                pending_vectors[j] = vector
+        with span("retrieval"):
+            for i, hits in zip(pending, self._retrieve(snapshot, [queries[i] for i in pending], pending_vectors, k)):
+                results[i] = hits
+        return results
+
+    def ingest(self, batches, register=None):
+        """
+        Add (texts, vectors, metadatas) batches to the knowledge base as one
+        new segment, so the I/O is proportional to the new chunks only.
+        Returns the ids of the chunks added.
+
+        register, if given, is called as register(ids) under the write lock,
+        which every process shares, just before the segment is published.
+        When it returns False the segment is dropped and nothing is added.
+        """
+        vectors, rows = [], []
+        for texts, batch_vectors, metadatas in batches:
+            ids = [uuid.uuid4().hex for _ in texts]
+            vectors.append(np.asarray(batch_vectors, dtype=np.float32))
+            rows.extend(zip(ids, texts, metadatas))
+        if not rows:
+            return []
+        vectors = np.concatenate(vectors)
+
+        if self._is_legacy(self._disk_version()):
+            self._upgrade()
+        # The segment is written outside the lock, only the manifest swap is serialized
+        name = self._write_segment(vectors, [(position, *row) for position, row in enumerate(rows)])
+        ids = [doc_id for doc_id, _, _ in rows]
+        with self._write_lock, self._file_lock():
+            if register is not None and not register(ids):
+                shutil.rmtree(self._segment_path(name), ignore_errors=True)
+                return []
+            segments, deleted = self._read_manifest(self._disk_version())
+            self._publish(segments + [name], deleted)
+        self.schedule_compaction()
+        return ids
+
+    def delete(self, doc_ids):
+        """Delete chunks by id. They stop matching at once; compaction reclaims their space."""
+        doc_ids = set(doc_ids)
+        if not doc_ids:
+            return
+        if self._is_legacy(self._disk_version()):
+            self._upgrade()
+        with self._write_lock, self._file_lock():
+            version = self._disk_version()
+            if version is None:
+                return
+            segments, deleted = self._read_manifest(version)
+            self._publish(segments, deleted | doc_ids)
+        self.schedule_compaction()
+
+    def _new_name(self):
+        return f"{time.time_ns()}-{os.getpid()}"
+
+    def _write_segment(self, vectors, rows, index=None):
+        """
+        Write vectors and (position, doc_id, text, metadata) rows, with the
+        postings of their text, as a new segment and return its name. The
+        vectors are indexed flat, or by the configured ANN type past the size
+        threshold, unless an index holding them is given.
+        """
+        if index is None:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+            if wants_ann(index):
+                index = migrate_to_ann(index)
+        name = self._new_name()
+        staging = self._segment_path(f".tmp-{name}")
+        os.makedirs(staging)
+        ChunkStore.append(staging, rows)
+        faiss.write_index(index, os.path.join(staging, Segment.INDEX_FILE))
+        # Kept exact beside the index, so compaction never rebuilds from quantized codes
+        np.save(os.path.join(staging, Segment.VECTORS_FILE), np.ascontiguousarray(vectors, dtype=np.float32))
+        for file_name in os.listdir(staging):
+            with open(os.path.join(staging, file_name), "rb") as f:
+                os.fsync(f.fileno())
+        os.rename(staging, self._segment_path(name))
+        return name
+
+    def _publish(self, segments, deleted=(), revision=None):
+        """
+        Write a manifest listing segments and deleted chunk ids, then atomically
+        make it CURRENT. revision is kept by publishes that do not change the
+        chunks served, and new otherwise. Call with the file lock held.
+        """
+        version = self._new_name()
+        manifest = self._manifest_path(version)
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        with open(manifest + ".tmp", "w") as f:
+            json.dump({"segments": segments, "deleted": sorted(deleted), "revision": revision or version}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(manifest + ".tmp", manifest)
+
+        current = os.path.join(self.index_path, self.CURRENT_FILE)
+        with open(current + ".tmp", "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current + ".tmp", current)
+        directory = os.open(self.index_path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        with self._lock:
+            self._snapshot, self._version = self._open(version), version
+        self._collect_garbage(version)
+
+    def _collect_garbage(self, current):
+        """
+        Remove superseded snapshots, keeping the newest KNOWLEDGE_BASE_KEEP_SNAPSHOTS
+        and anything younger than KNOWLEDGE_BASE_SNAPSHOT_GRACE seconds, which a
+        reader in another process may still be loading. Then remove segments
+        no kept snapshot lists, under the same grace period.
+        """
+        snapshots = os.path.join(self.index_path, self.SNAPSHOT_DIR)
+        paths = [os.path.join(snapshots, name) for name in os.listdir(snapshots) if name != f"{current}.json"]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        deadline = time.time() - settings.KNOWLEDGE_BASE_SNAPSHOT_GRACE
+        for path in paths[max(settings.KNOWLEDGE_BASE_KEEP_SNAPSHOTS - 1, 0):]:
+            if os.path.getmtime(path) < deadline:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+        live = set()
+        for name in os.listdir(snapshots):
+            if name.endswith(".json"):
+                try:
+                    live.update(self._read_manifest(name[:-len(".json")])[0])
+                except FileNotFoundError:
+                    pass
+        segments = os.path.join(self.index_path, self.SEGMENT_DIR)
+        for name in os.listdir(segments):
+            path = os.path.join(segments, name)
+            if name not in live and os.path.getmtime(path) < deadline:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def schedule_compaction(self):
+        compaction_executor().submit(self.compact)
+
+    def compact(self):
+        """
+        Rewrite segments until none has more than KNOWLEDGE_BASE_COMPACTION_DELETED
+        of its chunks deleted and no size tier holds KNOWLEDGE_BASE_COMPACTION_FACTOR
+        of them.
+        """
+        try:
+            with self._compact_lock:
+                while self._compact_tier():
+                    pass
+        except Exception as e:
+            logger.error("Knowledge base compaction failed: %s", e)
+
+    def _compaction_candidates(self, snapshot):
+        """
+        A segment with too many deleted chunks, or with its postings still in
+        lexical.pkl, on its own, else the segments in the smallest size tier
+        that has filled up. Tier t holds segments of
+        factor**t to factor**(t+1) live chunks, so repeated merging keeps fewer
+        than factor segments per tier.
+        """
+        for segment in snapshot.segments:
+            if snapshot.deleted_counts[segment.name] > settings.KNOWLEDGE_BASE_COMPACTION_DELETED * segment.index.ntotal:
+                return [segment]
+            if segment.legacy:
+                return [segment]
+        factor = settings.KNOWLEDGE_BASE_COMPACTION_FACTOR
+        if factor < 2:
+            return []
+        tiers = {}
+        for segment in snapshot.segments:
+            tiers.setdefault(int(math.log(max(snapshot.live_chunks(segment), 1), factor)), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= factor:
+                return tiers[tier]
+        return []
+
+    def _merged_rows(self, segments, deleted):
+        position = 0
+        for segment in segments:
+            for _, doc_id, text, metadata in segment.chunks.rows():
+                if doc_id not in deleted:
+                    yield position, doc_id, text, metadata
+                    position += 1
+
+    def _compact_tier(self):
+        snapshot = self._current()
+        group = self._compaction_candidates(snapshot) if snapshot else []
+        if not group:
+            return False
+        vectors, dropped = [], set()
+        for segment in group:
+            keep = np.array([doc_id not in snapshot.deleted for doc_id in segment.chunks.ids()], dtype=bool)
+            vectors.append(np.asarray(segment.vectors()[keep], dtype=np.float32))
+            dropped.update(segment.chunks.present(snapshot.deleted))
+        vectors = np.concatenate(vectors)
+        name = None
+        if len(vectors):
+            name = self._write_segment(vectors, self._merged_rows(group, dropped))
+
+        merged = {segment.name for segment in group}
+        with self._write_lock, self._file_lock():
+            version = self._disk_version()
+            segments, deleted = self._read_manifest(version)
+            if not merged <= set(segments):
+                # Another process compacted some of these segments first
+                if name:
+                    shutil.rmtree(self._segment_path(name), ignore_errors=True)
+                return False
+            first = segments.index(group[0].name)
+            kept = [segment for segment in segments if segment not in merged]
+            if name:
+                kept.insert(min(first, len(kept)), name)
+            # Merging serves the same chunks, so answers cached against this revision stay valid
+            self._publish(kept, deleted - dropped, revision=self._read_revision(version))
+        logger.info("Compacted %d segments into %d chunks, dropping %d deleted ones",
+                    len(group), len(vectors), len(dropped))
+        return True
+
+    def preload(self):
+        """
+        Open the current snapshot and have the OS read its segment files into
+        the page cache, so first searches do not fault them in from disk.
+        Returns the number of live chunks.
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            return 0
+        if any(segment.legacy for segment in snapshot.segments):
+            # Rewrite segments whose postings are still pickled, which every worker holds in memory
+            self.schedule_compaction()
+        for segment in snapshot.segments:
+            for file_name in os.listdir(segment.path):
+                with open(os.path.join(segment.path, file_name), "rb") as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        return sum(snapshot.live_chunks(segment) for segment in snapshot.segments)
+
+    @property
+    def version(self):
+        self._current()
+        return self._version
+
+    @property
+    def revision(self):
+        """Changes when chunks are added or deleted, but not when compaction merges segments."""
+        snapshot = self._current()
+        return snapshot.revision if snapshot is not None else None
@@ -0,0 +1,133 @@
+import math
+import os
+import pickle
+import re
+from collections import Counter
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._:/-][a-z0-9]+)*")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when where which who why "
+    "with does do can i me my we our you your".split()
+)
+# BM25 term frequency saturation and length normalization
+K1 = 1.5
+B = 0.75
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens. Compound identifiers such as CVE ids, table.column
+    names and log field keys are kept whole and also indexed by their parts.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        tokens.append(token)
+        parts = re.split(r"[._:/-]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part and part not in STOP_WORDS)
+    return tokens
+
+
+IDENTIFIER_RE = re.compile(r"[0-9._:/-]")
+
+
+def identifier_term(query):
+    """The query as one index term if it is a single identifier, e.g. a CVE id or table.column, else None."""
+    query = query.strip().lower()
+    if TOKEN_RE.fullmatch(query) is not None and IDENTIFIER_RE.search(query):
+        return query
+    return None
+
+
+def identifier_terms(query):
+    """The identifiers a query names anywhere in its text, such as CVE ids, ports and table.column, as index terms."""
+    return {token for token in TOKEN_RE.findall(query.lower()) if IDENTIFIER_RE.search(token)}
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over chunks, keyed by docstore id.
+
+    Segments keep their postings in their chunk store; this index only serves
+    segments written before that, which saved it as lexical.pkl, until
+    compaction rewrites them.
+    """
+
+    FILE_NAME = "lexical.pkl"
+
+    def __init__(self):
+        self.postings_by_term = {}  # term -> {doc_id: term frequency}
+        self.lengths = {}  # doc_id -> number of tokens
+        self.total_length = 0
+
+    def add(self, doc_id, text):
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            self.postings_by_term.setdefault(term, {})[doc_id] = frequency
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def lexical_stats(self):
+        return len(self.lengths), self.total_length
+
+    def postings(self, terms):
+        return {term: [(doc_id, frequency, self.lengths[doc_id])
+                       for doc_id, frequency in self.postings_by_term[term].items()]
+                for term in terms if term in self.postings_by_term}
+
+    def has_term(self, term):
+        return term in self.postings_by_term
+
+    def search(self, query, k):
+        """Return up to k (doc_id, score) pairs, best first."""
+        return search_indexes([self], query, k)
+
+    @classmethod
+    def load(cls, directory):
+        """Load the index saved in directory, or return None if there is none."""
+        try:
+            with open(os.path.join(directory, cls.FILE_NAME), "rb") as f:
+                postings, lengths, total_length = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        index = cls()
+        index.postings_by_term, index.lengths, index.total_length = postings, lengths, total_length
+        return index
+
+
+def search_indexes(indexes, query, k):
+    """
+    BM25 search across several indexes over disjoint chunks, such as the
+    segments of one knowledge base, scored as if they were a single index.
+    Each index is a ChunkStore or a LexicalIndex, and is asked only for the
+    postings of the query's terms.
+
+    Scores are normalized by the score of an average-length chunk containing
+    every query term once and capped at 1, so they can be fused with vector
+    relevance scores.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    stats = [index.lexical_stats() for index in indexes]
+    count = sum(chunks for chunks, _ in stats)
+    if not count:
+        return []
+    average_length = sum(total for _, total in stats) / count or 1
+    postings = {}
+    for index in indexes:
+        for term, matches in index.postings(terms).items():
+            postings.setdefault(term, []).extend(matches)
+    scores = {}
+    full_match = 0.0
+    for term in terms:
+        matches = postings.get(term, ())
+        idf = math.log(1 + (count - len(matches) + 0.5) / (len(matches) + 0.5))
+        full_match += idf
+        for doc_id, term_frequency, length in matches:
+            norm = K1 * (1 - B + B * length / average_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * term_frequency * (K1 + 1) / (term_frequency + norm)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [(doc_id, min(score / full_match, 1.0)) for doc_id, score in ranked]
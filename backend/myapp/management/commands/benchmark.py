@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the upload and chat paths offline. ChatOpenAI and OpenAIEmbeddings are replaced by "
+            "deterministic local fakes with the given latencies, and everything runs against a throwaway "
+            "database and knowledge base. Results are written as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=20, help="documents uploaded (corpus size)")
+        parser.add_argument("--document-chunks", type=int, default=20, help="approximate chunks per document")
+        parser.add_argument("--requests", type=int, default=100, help="chat requests sent")
+        parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+        parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per chat model call")
+        parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embedding call")
+        parser.add_argument("--dimension", type=int, default=1536, help="embedding dimension")
+        parser.add_argument("--ingestion-workers", type=int, default=settings.INGESTION_WORKERS)
+        parser.add_argument("--output", default="benchmark-results.json", help="JSON results file")
+
+    def handle(self, *args, **options):
+        # The fakes answer everything; the key only satisfies the real clients' constructors
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        logging.getLogger("myapp.requests").setLevel(logging.WARNING)
+
+        with tempfile.TemporaryDirectory() as workdir, override_settings(
+            KNOWLEDGE_BASE_DIR=os.path.join(workdir, "faiss_index"),
+            INGESTION_UPLOAD_DIR=os.path.join(workdir, "uploads"),
+            EMBEDDING_CACHE_PATH=os.path.join(workdir, "embeddings.sqlite3"),
+            INGESTION_WORKERS=options["ingestion_workers"],
+        ):
+            if connection.vendor == "sqlite":
+                # A file rather than the in-memory default, so the ingestion threads share it
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(workdir, "benchmark.sqlite3")
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                results = self.run_benchmark(options)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.report(results)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run_benchmark(self, options):
+        from myapp.benchmark import (FakeChatModel, FakeEmbeddings, bench_chat, bench_uploads, make_corpus,
+                                     make_questions)
+        from myapp.embeddings import CachedEmbeddings
+        from myapp.scheduler import embedding_scheduler
+        from myapp.views import ChatAPIView
+
+        bot = ChatAPIView.bot
+        bot.chatmodel = FakeChatModel(latency=options["llm_latency"])
+        bot.embeddings = CachedEmbeddings(
+            FakeEmbeddings(options["embedding_latency"], options["dimension"]), model="benchmark-fake",
+            scheduler=embedding_scheduler,
+        )
+        bot._knowledge_bases = {}
+        view = ChatAPIView.as_view()
+
+        corpus = make_corpus(options["documents"], options["document_chunks"], settings.INGESTION_CHUNK_SIZE)
+        upload = bench_uploads(view, corpus, options["concurrency"])
+        chat = bench_chat(view, make_questions(options["requests"]), options["concurrency"])
+        return {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "config": {key: options[key] for key in (
+                "documents", "document_chunks", "requests", "concurrency", "llm_latency",
+                "embedding_latency", "dimension", "ingestion_workers",
+            )},
+            "upload": upload,
+            "chat": chat,
+        }
+
+    def report(self, results):
+        upload, chat = results["upload"], results["chat"]
+        indexed = upload["upload_to_indexed"]
+        self.stdout.write(
+            f"upload: {upload['documents']} documents, {upload['chunks']} chunks in {upload['wall_seconds']}s "
+            f"({upload['chunks_per_second']} chunks/s), upload to indexed p50 {indexed.get('p50_ms')}ms "
+            f"p99 {indexed.get('p99_ms')}ms, peak RSS {upload['peak_rss_mb']}MB, {upload['errors']} errors"
+        )
+        latency = chat["latency"]
+        self.stdout.write(
+            f"chat: {chat['requests']} requests in {chat['wall_seconds']}s ({chat['requests_per_second']} req/s), "
+            f"p50 {latency.get('p50_ms')}ms p95 {latency.get('p95_ms')}ms p99 {latency.get('p99_ms')}ms, "
+            f"peak RSS {chat['peak_rss_mb']}MB, {chat['errors']} errors"
+        )
+        for stage, summary in chat["stages"].items():
+            self.stdout.write(f"  {stage}: p50 {summary['p50_ms']}ms p95 {summary['p95_ms']}ms "
+                              f"p99 {summary['p99_ms']}ms")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Create the chat bot and load its prompts, tokenizer and knowledge base indexes, reporting how long "
+            "each step took. Run it before a host takes traffic to convert indexes saved in older layouts and "
+            "fill the page cache; each worker process warms its own copy through /api/ready/.")
+
+    def handle(self, *args, **options):
+        from myapp.chatbot import warm_up
+
+        for step, seconds in warm_up().items():
+            self.stdout.write(f"{step}: {seconds}s")
+        self.stdout.write(self.style.SUCCESS("Chat bot warmed up"))
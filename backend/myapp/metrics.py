@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("myapp.requests")
+
+REQUEST_ID_HEADER = "X-Request-Id"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_labels(key, le=repr(bound))} {count}')
+                lines.append(f'{self.name}_bucket{_labels(key, le="+Inf")} {series[-2]}')
+                lines.append(f"{self.name}_count{_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_labels(key)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+def _labels(key, **extra):
+    pairs = [*key, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+REQUEST_SECONDS = Histogram("chat_request_duration_seconds", "Time to serve a request, by route and status.")
+STAGE_SECONDS = Histogram("chat_stage_duration_seconds", "Time spent in each stage of the chat pipeline.")
+TOKENS = Counter("chat_llm_tokens_total", "Tokens sent to and received from the chat model.")
+CACHE_LOOKUPS = Counter("chat_cache_lookups_total", "Answer and embedding cache lookups, by result.")
+QUEUE_DEPTH = Gauge("chat_scheduler_queue_depth", "Provider calls waiting for admission, by provider and priority.")
+QUEUE_SECONDS = Histogram("chat_scheduler_wait_seconds", "Time provider calls waited for admission.")
+QUEUE_REJECTIONS = Counter("chat_scheduler_rejections_total",
+                           "Provider calls refused because their queue was full or they waited too long.")
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, TOKENS, CACHE_LOOKUPS, QUEUE_DEPTH, QUEUE_SECONDS, QUEUE_REJECTIONS]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """The stage timings and attributes of one request, logged as one JSON line when it finishes."""
+
+    def __init__(self, route, request_id=None):
+        self.route = route
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> total milliseconds
+        self.attributes = {}
+
+
+def start_trace(route, request_id=None):
+    trace = Trace(route, request_id)
+    trace.token = _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace, status):
+    duration = time.perf_counter() - trace.started
+    try:
+        _current_trace.reset(trace.token)
+    except ValueError:
+        # Finished from another context than it was started in; nothing to restore
+        pass
+    REQUEST_SECONDS.observe(duration, route=trace.route, status=status)
+    logger.info(json.dumps({
+        "request_id": trace.request_id,
+        "route": trace.route,
+        "status": status,
+        "duration_ms": round(duration * 1000, 1),
+        "stages_ms": {stage: round(ms, 1) for stage, ms in trace.stages.items()},
+        **trace.attributes,
+    }))
+
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage into the stage histogram and the current request's trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.stages[stage] = trace.stages.get(stage, 0.0) + elapsed * 1000
+
+
+def annotate(**attributes):
+    """Attach attributes such as token counts or cache flags to the current request's log line."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+
+def record_cache(cache, hits=0, misses=0):
+    """Count cache lookups; the request is flagged a hit only if every lookup in it hit."""
+    CACHE_LOOKUPS.inc(hits, cache=cache, result="hit")
+    CACHE_LOOKUPS.inc(misses, cache=cache, result="miss")
+    trace = _current_trace.get()
+    if trace is not None and hits + misses:
+        key = f"{cache}_cache"
+        trace.attributes[key] = "miss" if misses or trace.attributes.get(key) == "miss" else "hit"
+
+
+def record_tokens(prompt_tokens, completion_tokens):
+    TOKENS.inc(prompt_tokens, kind="prompt")
+    TOKENS.inc(completion_tokens, kind="completion")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.attributes["prompt_tokens"] = trace.attributes.get("prompt_tokens", 0) + prompt_tokens
+        trace.attributes["completion_tokens"] = trace.attributes.get("completion_tokens", 0) + completion_tokens
+
+
+def request_trace_middleware(get_response):
+    """
+    Give every API request a request id, taken from the X-Request-Id header when
+    the client sends one, and log its trace when the view returns.
+    """
+    def skip(request):
+        return not request.path.startswith("/api/") or request.path.startswith(("/api/metrics", "/api/ready"))
+
+    def request_id(request):
+        return (request.headers.get(REQUEST_ID_HEADER) or "")[:128] or None
+
+    def finish(request, trace, response):
+        # Label by URL pattern rather than path, so ids in the path do not create a series each
+        trace.route = "/" + getattr(request.resolver_match, "route", "") if request.resolver_match else "unmatched"
+        response[REQUEST_ID_HEADER] = trace.request_id
+        finish_trace(trace, response.status_code)
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if skip(request):
+                return await get_response(request)
+            trace = start_trace(request.path, request_id(request))
+            response = await get_response(request)
+            finish(request, trace, response)
+            return response
+    else:
+        def middleware(request):
+            if skip(request):
+                return get_response(request)
+            trace = start_trace(request.path, request_id(request))
+            response = get_response(request)
+            finish(request, trace, response)
+            return response
+
+    return middleware
+
+
+request_trace_middleware.sync_capable = True
+request_trace_middleware.async_capable = True
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_auto_20240724_0920'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('file_name', models.TextField()),
+                ('file_path', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('pages_parsed', models.IntegerField(default=0)),
+                ('chunks_embedded', models.IntegerField(default=0)),
+                ('index_version', models.TextField(blank=True, default='')),
+                ('message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
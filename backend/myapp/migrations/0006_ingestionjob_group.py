@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='group',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
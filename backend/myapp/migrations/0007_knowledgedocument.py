@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_ingestionjob_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='document',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='replaces',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='KnowledgeDocument',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('source', models.TextField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('group', models.IntegerField(blank=True, null=True)),
+                ('chunk_ids', models.JSONField(default=list)),
+                ('ingested_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group', 'content_hash'], name='myapp_knowl_group_2c476f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_ingestionjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingestionjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('duplicate', 'Duplicate'), ('failed', 'Failed')], default='queued', max_length=16),
+        ),
+    ]
@@ -0,0 +1,59 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+
+
+class PromptResolver:
+    """
+    In-process cache of the admin prompts stored in the Prompt table.
+
+    The prompt views call invalidate() whenever a prompt or group is created,
+    updated or deleted, so steady-state chat turns never touch the database.
+    The TTL only bounds staleness across worker processes.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = settings.PROMPT_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._text = None
+        self._version = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._text = None
+            self._version = None
+
+    def _is_fresh(self):
+        if self._text is None:
+            return False
+        if self.ttl and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+        return True
+
+    def _load(self):
+        from .models import Prompt
+
+        texts = Prompt.objects.filter(is_default=True).order_by('id').values_list('text', flat=True)
+        return ', '.join(text or '' for text in texts)
+
+    def resolve(self):
+        """Return (admin_prompt_text, version) for the default prompts."""
+        with self._lock:
+            if not self._is_fresh():
+                self._text = self._load()
+                self._version = hashlib.sha1(self._text.encode('utf-8')).hexdigest()[:12]
+                self._loaded_at = time.monotonic()
+            return self._text, self._version
+
+    def admin_prompt(self):
+        return self.resolve()[0]
+
+    @property
+    def version(self):
+        return self.resolve()[1]
+
+
+prompt_resolver = PromptResolver()
@@ -0,0 +1,210 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import QUEUE_DEPTH, QUEUE_REJECTIONS, QUEUE_SECONDS, span
+
+INTERACTIVE = "interactive"
+INGESTION = "ingestion"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, INGESTION, BATCH)  # highest first
+
+_current_priority = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(name):
+    """Run the provider calls made inside the block, in this thread or tasks it spawns, at the given priority."""
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class Rejected(Exception):
+    """A provider call refused admission. status is the HTTP status to answer with: 429 or 503."""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills per_minute units a minute, holding at most a minute's worth. 0 means unlimited."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until amount can be taken. Amounts over the capacity only wait for a full bucket."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount):
+        # May go negative: an estimate that fell short is paid back by waiting longer next time
+        if self.capacity:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class Waiter:
+    def __init__(self, priority, tokens, wake):
+        self.priority = priority
+        self.tokens = tokens
+        self.wake = wake
+        self.admitted = False
+
+
+class Scheduler:
+    """
+    Admission control for the calls to one provider API.
+
+    Each call waits in the queue of its priority until the request and token
+    buckets can pay for it; interactive chat always goes before ingestion, and
+    ingestion before batch jobs. A call is refused with 429 when its queue is
+    already full, and with 503 once it has waited longer than its priority's
+    SCHEDULER_MAX_WAIT. Callers charge an estimate up front and settle() the
+    difference once the provider reports the real usage.
+
+    Limits apply per worker process, so divide the account's limits by the
+    number of workers.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._queues = {name: deque() for name in PRIORITIES}
+
+    def _dispatch(self):
+        """
+        Admit queued calls, highest priority first, while the buckets can pay
+        for them. Returns the seconds until the next one can go, or None when
+        the queues are empty. Call with the lock held.
+        """
+        now = time.monotonic()
+        try:
+            while True:
+                queue = next((self._queues[name] for name in PRIORITIES if self._queues[name]), None)
+                if queue is None:
+                    return None
+                head = queue[0]
+                delay = max(self.requests.delay(1, now), self.tokens.delay(head.tokens, now))
+                if delay > 0:
+                    return delay
+                self.requests.take(1)
+                self.tokens.take(head.tokens)
+                queue.popleft()
+                head.admitted = True
+                head.wake()
+        finally:
+            for name in PRIORITIES:
+                QUEUE_DEPTH.set(len(self._queues[name]), provider=self.name, priority=name)
+
+    def _retry_after(self):
+        queued = [waiter for name in PRIORITIES for waiter in self._queues[name]]
+        seconds = max(
+            len(queued) / self.requests.rate if self.requests.rate else 0,
+            sum(waiter.tokens for waiter in queued) / self.tokens.rate if self.tokens.rate else 0,
+        )
+        return max(1, math.ceil(seconds))
+
+    def _enqueue(self, tokens, wake):
+        name = _current_priority.get()
+        with self._lock:
+            queue = self._queues[name]
+            if len(queue) >= settings.SCHEDULER_QUEUE_LIMITS[name]:
+                QUEUE_REJECTIONS.inc(provider=self.name, priority=name, reason="queue_full")
+                raise Rejected(f"Too many {name} requests are queued for the {self.name} provider", 429,
+                               self._retry_after())
+            waiter = Waiter(name, tokens, wake)
+            queue.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def _poll(self, waiter, started):
+        """
+        Seconds to wait before checking waiter again; raises Rejected once it
+        has waited too long. Returns None when it has been admitted.
+        """
+        with self._lock:
+            delay = self._dispatch()
+            if waiter.admitted:
+                return None
+            remaining = started + settings.SCHEDULER_MAX_WAIT[waiter.priority] - time.monotonic()
+            if remaining <= 0:
+                self._queues[waiter.priority].remove(waiter)
+                self._dispatch()
+                QUEUE_REJECTIONS.inc(provider=self.name, priority=waiter.priority, reason="timeout")
+                raise Rejected(f"Timed out waiting for the {self.name} provider", 503, self._retry_after())
+            return min(delay, remaining)
+
+    def _withdraw(self, waiter):
+        with self._lock:
+            if not waiter.admitted:
+                self._queues[waiter.priority].remove(waiter)
+                self._dispatch()
+
+    def _admitted(self, waiter, started):
+        QUEUE_SECONDS.observe(time.monotonic() - started, provider=self.name, priority=waiter.priority)
+
+    def acquire(self, tokens):
+        """Block until a call costing about tokens is admitted, or raise Rejected."""
+        started = time.monotonic()
+        event = threading.Event()
+        with span("queue"):
+            waiter = self._enqueue(tokens, event.set)
+            delay = self._poll(waiter, started)
+            while delay is not None:
+                event.wait(delay)
+                delay = self._poll(waiter, started)
+        self._admitted(waiter, started)
+
+    async def aacquire(self, tokens):
+        """acquire() for the event loop: waits without holding a thread."""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with span("queue"):
+            waiter = self._enqueue(tokens, lambda: loop.call_soon_threadsafe(event.set))
+            try:
+                delay = self._poll(waiter, started)
+                while delay is not None:
+                    try:
+                        await asyncio.wait_for(event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    delay = self._poll(waiter, started)
+            except asyncio.CancelledError:
+                # The request timed out or the client went away; leave the queue to the others
+                self._withdraw(waiter)
+                raise
+        self._admitted(waiter, started)
+
+    def settle(self, estimated, actual):
+        """Correct the token bucket once a call's real usage is known."""
+        with self._lock:
+            self.tokens.take(actual - estimated)
+
+
+llm_scheduler = Scheduler("llm", settings.LLM_REQUESTS_PER_MINUTE, settings.LLM_TOKENS_PER_MINUTE)
+embedding_scheduler = Scheduler("embedding", settings.EMBEDDING_REQUESTS_PER_MINUTE,
+                                settings.EMBEDDING_TOKENS_PER_MINUTE)
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from drf_yasg import openapi
-from .models import Prompt, PromptGroup
+from .models import IngestionJob, KnowledgeDocument, Prompt, PromptGroup
 
 # Define the request body and response body in the Swagger document
 question_schema = openapi.Schema(
@@ -11,6 +11,44 @@ question_schema = openapi.Schema(
             description='Question for the chatbot',
             example='how are you'
         ),
+        'conversation_id': openapi.Schema(
+            type=openapi.TYPE_STRING,
+            description='Id of the conversation the question belongs to; omit for a one-off question',
+            example='3f2b9c1e-conversation'
+        ),
+        'group': openapi.Schema(
+            type=openapi.TYPE_INTEGER,
+            description='Prompt group whose knowledge base is searched, or receives the upload; omit for the shared one',
+            example=1
+        ),
+    }
+)
+batch_question_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    required=['questions'],
+    properties={
+        'questions': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(type=openapi.TYPE_STRING),
+            description='Standalone questions for the chatbot, answered without conversation history',
+            example=['what does the src_ip column hold?', 'which table records logon events?']
+        ),
+        'group': openapi.Schema(
+            type=openapi.TYPE_INTEGER,
+            description='Prompt group whose knowledge base is searched for every question; omit for the shared one',
+            example=1
+        ),
+    }
+)
+batch_response_schema = openapi.Response(
+    description="One result per question, in order: an answer and its type, or an error",
+    examples={
+        "application/json": {
+            "answers": [
+                {"answer": "The source IP address of the connection.", "type": "text"},
+                {"error": "Question is required"}
+            ]
+        }
     }
 )
 response_schema = openapi.Response(
@@ -30,4 +68,15 @@ class PromptSerializer(serializers.ModelSerializer):
 class PromptGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = PromptGroup
-        fields = ['group_id', 'group_name']
\ No newline at end of file
+        fields = ['group_id', 'group_name']
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'file_name', 'group', 'status', 'pages_parsed', 'chunks_embedded', 'index_version',
+                  'content_hash', 'replaces', 'document', 'message', 'created_at', 'updated_at']
+
+class KnowledgeDocumentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = KnowledgeDocument
+        fields = ['id', 'source', 'content_hash', 'group', 'chunk_ids', 'ingested_at']
@@ -1,3 +1,399 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from .answer_cache import AnswerScope, SemanticAnswerCache
+from .benchmark import FakeEmbeddings
+from .chatbot import ChatBot, FileType
+from .context import CHUNK_SEPARATOR, RAG_CONTEXT_PROMPT, assemble_prompt
+from .conversations import ConversationStore
+from .knowledge_base import KnowledgeBase, compaction_executor
+from .metrics import finish_trace, start_trace
+from .models import KnowledgeDocument, Prompt, PromptGroup
+from .prompts import PromptResolver, prompt_resolver
+from .scheduler import BATCH, INTERACTIVE, Rejected, Scheduler, priority
+from .tokens import count_tokens, message_tokens
+from .views import parse_chat_scope
+
+
+@override_settings(KNOWLEDGE_BASE_COMPACTION_FACTOR=100, KNOWLEDGE_BASE_COMPACTION_DELETED=1.0,
+                   KNOWLEDGE_BASE_INDEX_TYPE="flat", KNOWLEDGE_BASE_MMAP=True)
+class KnowledgeBaseTests(SimpleTestCase):
+    """Segments, snapshots and compaction of the knowledge base, with deterministic fake embeddings."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.embeddings = FakeEmbeddings(dimension=64)
+        self.knowledge_base = KnowledgeBase(self.embeddings, self.directory)
+
+    def tearDown(self):
+        # Let compactions scheduled by the test finish before their files go
+        compaction_executor().submit(lambda: None).result()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def ingest(self, texts, knowledge_base=None):
+        knowledge_base = knowledge_base or self.knowledge_base
+        metadatas = [{"n": i} for i in range(len(texts))]
+        return knowledge_base.ingest([(texts, self.embeddings.embed_documents(texts), metadatas)])
+
+    def live_ids(self, knowledge_base=None):
+        snapshot = (knowledge_base or self.knowledge_base)._current()
+        return {doc_id for segment in snapshot.segments for doc_id in segment.chunks.ids()} - snapshot.deleted
+
+    def test_search_empty_knowledge_base(self):
+        self.assertEqual(self.knowledge_base.search("anything", 4), [])
+        self.assertIsNone(self.knowledge_base.version)
+
+    def test_ingest_and_search(self):
+        ids = self.ingest(["firewall rules block port 443", "kerberos tickets expire", "dns queries to resolvers"])
+        self.assertEqual(len(ids), 3)
+        hits = self.knowledge_base.search("kerberos tickets expire", 2)
+        self.assertEqual(hits[0][0].id, ids[1])
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+        self.assertEqual(hits[0][0].metadata, {"n": 1})
+
+    def test_identifier_search_skips_embedding(self):
+        ids = self.ingest(["CVE-2024-1111 affects the proxy", "auth_logs.src_ip holds the client address"])
+        self.assertTrue(self.knowledge_base.is_identifier("cve-2024-1111"))
+        self.assertFalse(self.knowledge_base.is_identifier("CVE-2024-9999"))
+        self.embeddings.embed_query = None  # any embedding call would fail
+        self.assertEqual(self.knowledge_base.search("CVE-2024-1111", 4)[0][0].id, ids[0])
+
+    @override_settings(RAG_RELEVANCE_THRESHOLD=0.8, RAG_TOP_K=4)
+    def test_identifier_hits_clear_the_relevance_threshold(self):
+        filler = " ".join(f"filler{i}" for i in range(40))
+        ids = self.ingest([f"CVE-2024-1111 affects the reverse proxy. {filler}",
+                           "kerberos tickets expire after ten hours", "dns queries go to the resolvers"])
+        bot = object.__new__(ChatBot)
+        bot._knowledge_bases, bot._knowledge_bases_lock = {None: self.knowledge_base}, threading.Lock()
+        hits = bot.search_from_knowledge_base("CVE-2024-1111")
+        self.assertEqual([(document.id, score) for document, score in hits], [(ids[0], 1.0)])
+        # Named inside a question, which the fake embeddings place nowhere near the chunk
+        hits = bot.search_from_knowledge_base("which service does cve-2024-1111 affect?")
+        self.assertEqual([(document.id, score) for document, score in hits], [(ids[0], 1.0)])
+        self.assertEqual(bot.search_from_knowledge_base("CVE-2024-9999"), [])
+
+    def test_delete_hides_chunks_and_keeps_revision_moving(self):
+        ids = self.ingest(["alpha chunk", "bravo chunk"])
+        revision = self.knowledge_base.revision
+        self.knowledge_base.delete([ids[0]])
+        self.assertNotEqual(self.knowledge_base.revision, revision)
+        self.assertNotIn(ids[0], [document.id for document, _ in self.knowledge_base.search("alpha chunk", 4)])
+        self.assertEqual(self.live_ids(), {ids[1]})
+
+    def test_compaction_merges_segments_and_drops_deleted_chunks(self):
+        ids = [doc_id for i in range(4) for doc_id in self.ingest([f"file {i} chunk {j}" for j in range(3)])]
+        self.knowledge_base.delete(ids[:2])
+        revision = self.knowledge_base.revision
+        with self.settings(KNOWLEDGE_BASE_COMPACTION_FACTOR=4):
+            self.knowledge_base.compact()
+        snapshot = self.knowledge_base._current()
+        self.assertEqual(len(snapshot.segments), 1)
+        self.assertEqual(snapshot.deleted, set())
+        self.assertEqual(snapshot.segments[0].chunks.ids(), ids[2:])
+        # Compaction serves the same chunks, so answers cached against the revision stay valid
+        self.assertEqual(self.knowledge_base.revision, revision)
+        self.assertEqual(self.knowledge_base.search("file 3 chunk 1", 1)[0][0].id, ids[10])
+
+    @override_settings(KNOWLEDGE_BASE_INDEX_TYPE="ivfpq", KNOWLEDGE_BASE_ANN_MIN_CHUNKS=200,
+                       KNOWLEDGE_BASE_IVF_NLIST=4, KNOWLEDGE_BASE_PQ_M=8, KNOWLEDGE_BASE_PQ_NBITS=4)
+    def test_compaction_rebuilds_from_exact_vectors(self):
+        texts = [[f"batch {i} chunk {j}" for j in range(150)] for i in range(4)]
+        with self.settings(KNOWLEDGE_BASE_COMPACTION_FACTOR=2):
+            # Pairs of flat segments merge into IVF-PQ ones, which then merge with each other
+            for batch in texts:
+                self.ingest(batch)
+                self.knowledge_base.compact()
+        snapshot = self.knowledge_base._current()
+        self.assertEqual(len(snapshot.segments), 1)
+        segment = snapshot.segments[0]
+        self.assertEqual(segment.index.ntotal, 600)
+        expected = np.asarray(self.embeddings.embed_documents([text for batch in texts for text in batch]),
+                              dtype=np.float32)
+        np.testing.assert_array_equal(np.asarray(segment.vectors()), expected)
+
+    def test_concurrent_publishes_keep_every_chunk(self):
+        # Two holders of the same directory stand in for two worker processes
+        other = KnowledgeBase(self.embeddings, self.directory)
+        added, errors = [], []
+
+        def upload(knowledge_base, name):
+            try:
+                for i in range(5):
+                    added.extend(self.ingest([f"{name} upload {i}"], knowledge_base))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=upload, args=(knowledge_base, name))
+                   for knowledge_base, name in ((self.knowledge_base, "first"), (other, "second"))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(added), 10)
+        self.assertEqual(self.live_ids(), set(added))
+        self.assertEqual(self.live_ids(other), set(added))
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, KnowledgeBase.SEGMENT_DIR))), 10)
+
+
+class ChatScopeTests(TestCase):
+    """Validation of the question, conversation id and group shared by the chat endpoints."""
+
+    def test_conversation_id_from_body_or_header(self):
+        self.assertEqual(parse_chat_scope({"question": "hi", "conversation_id": 7}, {}), ("7", None))
+        self.assertEqual(parse_chat_scope({}, {"X-Conversation-Id": "abc"}), ("abc", None))
+        with self.assertRaises(ValueError):
+            parse_chat_scope({"conversation_id": ["abc"]}, {})
+
+    def test_question_must_be_a_string(self):
+        for question in (["x"], {"text": "x"}, 5):
+            with self.assertRaisesMessage(ValueError, "question must be a string"):
+                parse_chat_scope({"question": question}, {})
+
+    def test_group_must_exist(self):
+        group = PromptGroup.objects.create(group_name="soc")
+        self.assertEqual(parse_chat_scope({"group": str(group.pk)}, {}), (None, group.pk))
+        with self.assertRaisesMessage(ValueError, "Prompt group not found"):
+            parse_chat_scope({"group": group.pk + 1}, {})
+        for url in ("/api/chat/", "/api/chat/stream/", "/api/chat/async/"):
+            response = self.client.post(url, {"question": "hi", "group": group.pk + 1}, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+
+class DocumentRegistryTests(TestCase):
+    """Registration of uploaded files as KnowledgeDocuments, one per content hash and group."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bot = object.__new__(ChatBot)
+        self.bot.embeddings = FakeEmbeddings(dimension=64)
+        self.knowledge_base = KnowledgeBase(self.bot.embeddings, self.directory)
+        self.bot._knowledge_bases, self.bot._knowledge_bases_lock = {None: self.knowledge_base}, threading.Lock()
+
+    def tearDown(self):
+        compaction_executor().submit(lambda: None).result()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def upload(self, progress=None):
+        file_result = {"type": FileType.FILE.value, "segments": [("firewall rules block port 443", {})]}
+        return self.bot.update_knowledge_base(file_result, "rules.txt", progress=progress, digest="abc")
+
+    def test_reupload_is_a_duplicate(self):
+        _, document, duplicate = self.upload()
+        self.assertFalse(duplicate)
+        _, again, duplicate = self.upload()
+        self.assertTrue(duplicate)
+        self.assertEqual(again.id, document.id)
+
+    def test_upload_times_parsing_and_embedding(self):
+        trace = start_trace("/api/chat/")
+        try:
+            self.upload()
+        finally:
+            finish_trace(trace, 202)
+        self.assertIn("parse", trace.stages)
+        self.assertIn("embedding", trace.stages)
+
+    def test_concurrent_identical_uploads_register_once(self):
+        racing = []
+
+        def progress(**counts):
+            # The same file, submitted twice, finishes embedding first
+            if "chunks_embedded" in counts and not racing:
+                racing.append(self.upload())
+
+        _, document, duplicate = self.upload(progress)
+        self.assertTrue(duplicate)
+        _, winner, winner_duplicate = racing[0]
+        self.assertFalse(winner_duplicate)
+        self.assertEqual(document.id, winner.id)
+        self.assertEqual(KnowledgeDocument.objects.count(), 1)
+        # The loser's segment is dropped, so no chunk is served twice
+        snapshot = self.knowledge_base._current()
+        self.assertEqual([segment.chunks.ids() for segment in snapshot.segments], [winner.chunk_ids])
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, KnowledgeBase.SEGMENT_DIR))), 1)
+
+
+class SchedulerTests(SimpleTestCase):
+    """Admission of provider calls: priorities, full queues, waiting too long and settling usage."""
+
+    def drained(self, **limits):
+        scheduler = Scheduler("test", **limits)
+        scheduler.requests.level = 0.0
+        return scheduler
+
+    def test_unlimited_calls_are_admitted_at_once(self):
+        scheduler = Scheduler("test")
+        for _ in range(100):
+            scheduler.acquire(1000)
+
+    def test_interactive_calls_go_before_batch_calls(self):
+        scheduler = self.drained(requests_per_minute=60)
+        admitted = []
+        with priority(BATCH):
+            scheduler._enqueue(1, lambda: admitted.append(BATCH))
+        scheduler._enqueue(1, lambda: admitted.append(INTERACTIVE))
+        self.assertEqual(admitted, [])
+        # One request's worth refills: it goes to the interactive call although the batch call queued first
+        scheduler.requests.level, scheduler.requests.updated = 1.0, time.monotonic()
+        with scheduler._lock:
+            scheduler._dispatch()
+        self.assertEqual(admitted, [INTERACTIVE])
+
+    @override_settings(SCHEDULER_QUEUE_LIMITS={"interactive": 1, "ingestion": 1, "batch": 1})
+    def test_full_queue_is_rejected_with_429(self):
+        scheduler = self.drained(requests_per_minute=1)
+        scheduler._enqueue(1, lambda: None)
+        with self.assertRaises(Rejected) as raised:
+            scheduler.acquire(1)
+        self.assertEqual(raised.exception.status, 429)
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        # Other priorities have queues of their own
+        with priority(BATCH):
+            scheduler._enqueue(1, lambda: None)
+
+    @override_settings(SCHEDULER_MAX_WAIT={"interactive": 0.05, "ingestion": 0.05, "batch": 0.05})
+    def test_waiting_too_long_is_rejected_with_503(self):
+        scheduler = self.drained(requests_per_minute=1)
+        with self.assertRaises(Rejected) as raised:
+            scheduler.acquire(1)
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(len(scheduler._queues[INTERACTIVE]), 0)
+
+    def test_settle_charges_the_real_usage(self):
+        scheduler = Scheduler("test", tokens_per_minute=1000)
+        scheduler.acquire(100)
+        self.assertAlmostEqual(scheduler.tokens.level, 900, delta=1)
+        scheduler.settle(100, 250)
+        self.assertAlmostEqual(scheduler.tokens.level, 750, delta=1)
+        scheduler.settle(100, 40)
+        self.assertAlmostEqual(scheduler.tokens.level, 810, delta=1)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    """Answers cached per prompt group and version, matched by embedding and identifiers."""
+
+    def setUp(self):
+        self.cache = SemanticAnswerCache(threshold=0.95, ttl=0, max_entries=10)
+        self.vector = [1.0, 0.0, 0.0]
+
+    def scope(self, group=1, version="v1"):
+        return AnswerScope(group, version, time.monotonic())
+
+    def test_similar_question_hits(self):
+        self.cache.store(self.scope(), self.vector, "what does the firewall log?", "connections")
+        self.assertEqual(self.cache.lookup(self.scope(), [0.99, 0.05, 0.0], "what is the firewall logging?"),
+                         "connections")
+        self.assertIsNone(self.cache.lookup(self.scope(), [0.0, 1.0, 0.0], "who rotates the keys?"))
+
+    def test_identifiers_must_match(self):
+        self.cache.store(self.scope(), self.vector, "what does port 443 carry?", "https")
+        self.assertIsNone(self.cache.lookup(self.scope(), self.vector, "what does port 8443 carry?"))
+        self.assertEqual(self.cache.lookup(self.scope(), self.vector, "What does port 443 carry?"), "https")
+
+    def test_questions_without_vector_match_by_text(self):
+        self.cache.store(self.scope(), None, "CVE-2024-1111", "the proxy")
+        self.assertEqual(self.cache.lookup(self.scope(), None, "  cve-2024-1111 "), "the proxy")
+        self.assertIsNone(self.cache.lookup(self.scope(), self.vector, "CVE-2024-1111"))
+
+    def test_new_version_empties_only_its_group(self):
+        self.cache.store(self.scope(group=1), self.vector, "q", "old answer")
+        self.cache.store(self.scope(group=2), self.vector, "q", "other group")
+        self.assertIsNone(self.cache.lookup(self.scope(group=1, version="v2"), self.vector, "q"))
+        self.assertEqual(self.cache.lookup(self.scope(group=2), self.vector, "q"), "other group")
+
+    def test_stale_scope_is_refused(self):
+        # Read before the group moved to v2, e.g. by a request that was still waiting for the model
+        stale = self.scope(version="v1")
+        self.cache.lookup(self.scope(version="v2"), self.vector, "q")
+        self.cache.store(stale, self.vector, "q", "outdated answer")
+        self.assertIsNone(self.cache.lookup(stale, self.vector, "q"))
+        self.assertIsNone(self.cache.lookup(self.scope(version="v2"), self.vector, "q"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+
+class PromptAssemblyTests(SimpleTestCase):
+    """Packing the system prefix, retrieved chunks and history into the token budget."""
+
+    def setUp(self):
+        self.system = SystemMessage(content="You answer questions about security logs.")
+        self.question = HumanMessage(content="Which table records logon events?")
+        self.fixed = message_tokens(self.system) + message_tokens(self.question)
+
+    def test_chunks_are_dropped_whole_lowest_score_first(self):
+        best = Document(page_content="auth_logs records every logon event with its source address.")
+        worse = Document(page_content="dns_logs records resolver queries. " * 5)
+        header = message_tokens(SystemMessage(content=RAG_CONTEXT_PROMPT.format(context="")))
+        budget = self.fixed + header + count_tokens(best.page_content + CHUNK_SEPARATOR) + 5
+        messages = assemble_prompt(self.system, [], self.question, [(worse, 0.85), (best, 0.9)], budget=budget)
+        self.assertEqual(messages[0], self.system)
+        self.assertEqual(messages[-1], self.question)
+        self.assertEqual(messages[1].content, RAG_CONTEXT_PROMPT.format(context=best.page_content))
+
+    def test_history_keeps_recent_turns_without_orphan_answers(self):
+        history = [HumanMessage(content="first question"), AIMessage(content="first answer"),
+                   HumanMessage(content="second question"), AIMessage(content="second answer")]
+        # Room for the last three messages, so the first answer would lose its question
+        budget = self.fixed + sum(message_tokens(message) for message in history[1:])
+        messages = assemble_prompt(self.system, history, self.question, [], budget=budget)
+        self.assertEqual(messages, [self.system, history[2], history[3], self.question])
+
+    def test_system_message_and_question_are_always_sent(self):
+        history = [HumanMessage(content="earlier question"), AIMessage(content="earlier answer")]
+        hits = [(Document(page_content="some context"), 0.9)]
+        self.assertEqual(assemble_prompt(self.system, history, self.question, hits, budget=0),
+                         [self.system, self.question])
+
+
+class ConversationStoreTests(SimpleTestCase):
+    """History per conversation, trimmed to the token window."""
+
+    def test_trim_keeps_the_most_recent_messages_in_the_window(self):
+        messages = [HumanMessage(content=f"message number {i}") for i in range(4)]
+        store = ConversationStore(token_window=message_tokens(messages[0]) * 2 + 1)
+        self.assertEqual(store.trim(messages), messages[2:])
+
+    def test_trim_keeps_the_last_message_even_past_the_window(self):
+        message = HumanMessage(content="a very long question " * 20)
+        self.assertEqual(ConversationStore(token_window=5).trim([HumanMessage(content="hi"), message]), [message])
+
+    def test_history_is_kept_per_conversation(self):
+        store = ConversationStore()
+        store.save("tests-a", [HumanMessage(content="hello")])
+        self.assertEqual([message.content for message in store.load("tests-a")], ["hello"])
+        self.assertEqual(store.load("tests-b"), [])
+        store.save(None, [HumanMessage(content="dropped")])
+        self.assertEqual(store.load(None), [])
+
+
+class PromptResolverTests(TestCase):
+    """The admin prompt cache and its invalidation."""
+
+    def test_resolve_is_cached_until_invalidated(self):
+        resolver = PromptResolver(ttl=0)
+        Prompt.objects.create(text="Be brief.", is_default=1, group=1)
+        text, version = resolver.resolve()
+        self.assertEqual(text, "Be brief.")
+        Prompt.objects.create(text="Cite the sources.", is_default=1, group=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve(), (text, version))
+        resolver.invalidate()
+        text, new_version = resolver.resolve()
+        self.assertEqual(text, "Be brief., Cite the sources.")
+        self.assertNotEqual(new_version, version)
+
+    def test_prompt_views_invalidate_the_shared_resolver(self):
+        version = prompt_resolver.version
+        response = self.client.post("/api/prompts/", {"text": "Answer in English.", "name": "language",
+                                                      "is_default": 1, "group": 1}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(prompt_resolver.version, version)
+        self.assertIn("Answer in English.", prompt_resolver.admin_prompt())
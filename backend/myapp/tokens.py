@@ -0,0 +1,37 @@
+import threading
+
+from django.conf import settings
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.encoding_for_model(settings.CHAT_MODEL)
+            except Exception:
+                # Unknown model or no tiktoken data available offline: estimate instead
+                _encoding = False
+        return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if not encoding:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_text(message):
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(item.get("text", "") for item in message.content if isinstance(item, dict))
+
+
+def message_tokens(message):
+    # Every chat message costs a few tokens of framing on top of its content
+    return count_tokens(message_text(message)) + 4
@@ -1,8 +1,16 @@
 from django.urls import path
-from .views import ChatAPIView, PromptListCreateAPIView, DefaultPromptAPIView, PromptDetailAPIView,PromptGroupListCreateAPIView, PromptGroupDetailAPIView,PromptByGroupAPIView
+from .views import ChatAPIView, ChatBatchAPIView, ChatStreamAPIView, chat_async, metrics, ready, IngestionJobAPIView, KnowledgeDocumentListAPIView, KnowledgeDocumentDetailAPIView, PromptListCreateAPIView, DefaultPromptAPIView, PromptDetailAPIView,PromptGroupListCreateAPIView, PromptGroupDetailAPIView,PromptByGroupAPIView
 
 urlpatterns = [
     path('chat/', ChatAPIView.as_view(), name='chat'),
+    path('chat/stream/', ChatStreamAPIView.as_view(), name='chat_stream'),
+    path('chat/async/', chat_async, name='chat_async'),
+    path('chat/batch/', ChatBatchAPIView.as_view(), name='chat_batch'),
+    path('metrics/', metrics, name='metrics'),
+    path('ready/', ready, name='ready'),
+    path('ingestion/<int:id>/', IngestionJobAPIView.as_view(), name='ingestion_job'),
+    path('documents/', KnowledgeDocumentListAPIView.as_view(), name='knowledge_document_list'),
+    path('documents/<int:id>/', KnowledgeDocumentDetailAPIView.as_view(), name='knowledge_document_detail'),
     path('prompts/', PromptListCreateAPIView.as_view(), name='prompt_list_create'),
     path('prompts/<int:id>/', PromptDetailAPIView.as_view(), name='prompt_detail'),
     path('prompts/default/', DefaultPromptAPIView.as_view(), name='get_default_prompt'),
@@ -1,35 +1,169 @@
 import re
+import json
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
-from .models import ChatBot, Prompt, PromptGroup
-from .serializers import PromptSerializer, PromptGroupSerializer, question_schema, response_schema
+from .ingestion import INGESTIBLE_EXTENSIONS, content_hash, is_ingestible
+from .jobs import enqueue_upload
+from .metrics import render as render_metrics, span
+from .models import IngestionJob, KnowledgeDocument, Prompt, PromptGroup
+from .prompts import prompt_resolver
+from .scheduler import BATCH, Rejected, priority
+from .serializers import (IngestionJobSerializer, KnowledgeDocumentSerializer, PromptSerializer, PromptGroupSerializer,
+                          batch_question_schema, batch_response_schema, question_schema, response_schema)
+
+def classify_answer(feedback):
+    feedback_lower = feedback.lower()
+    return "capabilityMap" if "```json" in feedback_lower else "image" if "```xml" in feedback_lower else "text"
+
+
+def parse_group(value):
+    """
+    Return the prompt group id a request is scoped to, None for the shared
+    knowledge base. Raises ValueError unless the group exists, since each
+    group gets a knowledge base and an answer cache of its own.
+    """
+    if value in (None, ''):
+        return None
+    try:
+        group = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("group must be a prompt group id")
+    if not PromptGroup.objects.filter(pk=group).exists():
+        raise ValueError("Prompt group not found")
+    return group
+
+
+def parse_chat_scope(data, headers):
+    """
+    Return the (conversation_id, group) a chat request is scoped to, taking the
+    conversation id from the body or the X-Conversation-Id header. Raises
+    ValueError with a message for the client when either, or the question, is invalid.
+    """
+    if data.get('question') is not None and not isinstance(data.get('question'), str):
+        raise ValueError("question must be a string")
+    conversation_id = data.get('conversation_id') or headers.get('X-Conversation-Id')
+    if conversation_id is not None:
+        # JSON clients may send numeric ids; anything else that is not a string is a client error
+        if isinstance(conversation_id, bool) or not isinstance(conversation_id, (str, int)):
+            raise ValueError("conversation_id must be a string")
+        conversation_id = str(conversation_id)
+        if len(conversation_id) > 128:
+            raise ValueError("conversation_id is too long")
+    return conversation_id, parse_group(data.get('group'))
+
+
+def unsupported_upload_message():
+    return "Only {} files can be added to the knowledge base".format(
+        ", ".join(extension.upper() for extension in INGESTIBLE_EXTENSIONS))
+
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def sse_answer(tokens):
+    """Server-Sent Events for an answer streamed as tokens: one per token, then done, or error on failure."""
+    answer = []
+    try:
+        for token in tokens:
+            answer.append(token)
+            yield sse_event({"token": token})
+    except Exception as e:
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    feedback = "".join(answer)
+    yield sse_event({"answer": feedback, "type": classify_answer(feedback)}, event="done")
+
+
+async def asse_answer(tokens):
+    """sse_answer() for tokens from an async iterator."""
+    answer = []
+    try:
+        async for token in tokens:
+            answer.append(token)
+            yield sse_event({"token": token})
+    except Exception as e:
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    feedback = "".join(answer)
+    yield sse_event({"answer": feedback, "type": classify_answer(feedback)}, event="done")
+
+
+class LazyChatBot:
+    """
+    The ChatBot singleton as a class attribute, created on first access rather
+    than when the views are imported, so management commands and prompt-only
+    traffic never load LangChain, FAISS or the model clients.
+    """
+
+    def __get__(self, instance, owner):
+        from .chatbot import ChatBot
+
+        return ChatBot()
+
 
 class ChatAPIView(APIView):
-    bot = ChatBot()  # Singleton instance
+    bot = LazyChatBot()  # Singleton instance
 
     @swagger_auto_schema(
         operation_id="chat_with_bot",
         operation_summary="Chat with the bot",
         operation_description="Send a question to the bot and receive an answer",
         request_body=question_schema,
-        responses={200: response_schema}
+        responses={200: response_schema, 429: "Too many requests queued for the model provider",
+                   503: "Timed out waiting for the model provider"}
     )
     def post(self, request, *args, **kwargs):
         """Process POST request, return chatbot reply"""
         question = request.data.get('question')
         upload_file = request.FILES.get('image')
+        try:
+            conversation_id, group = parse_chat_scope(request.data, request.headers)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         if not question:
             if not upload_file:
                 return Response({"error": "Question is required"}, status=status.HTTP_400_BAD_REQUEST)
             else:
                 question = "This is a task to convert different diagrams to a BPMN 2.0 XML format."
 
+        if upload_file:
+            if not is_ingestible(upload_file.name):
+                return Response({"error": unsupported_upload_message()}, status=status.HTTP_400_BAD_REQUEST)
+            # Re-uploads of a file already in the knowledge base are answered without re-embedding it
+            digest = content_hash(upload_file)
+            existing = KnowledgeDocument.objects.filter(group=group, content_hash=digest).first()
+            if existing:
+                response_data = {
+                    "answer": f"{upload_file.name} is already in the knowledge base (document {existing.id})",
+                    "type": "text",
+                    "document_id": existing.id
+                }
+                return Response({"answer": response_data}, status=status.HTTP_200_OK)
+            # Parsing and embedding run in the background; the client polls the job
+            job = enqueue_upload(upload_file, group, digest=digest)
+            response_data = {
+                "answer": f"{upload_file.name} is being added to the knowledge base (job {job.id})",
+                "type": "text",
+                "job_id": job.id
+            }
+            return Response({"answer": response_data}, status=status.HTTP_202_ACCEPTED)
+
         # print("user initial question", question)
-        feedback = self.bot.answer(question, upload_file)
-        feedback_lower = feedback.lower()
-        type = "capabilityMap" if "```json" in feedback_lower else "image" if "```xml" in feedback_lower else "text"
+        try:
+            feedback = self.bot.answer(question, conversation_id, group)
+        except Rejected as e:
+            return Response({"error": str(e)}, status=e.status, headers={"Retry-After": str(e.retry_after)})
+        with span("classify"):
+            type = classify_answer(feedback)
 
         response_data = {
             "answer": feedback,
@@ -39,6 +173,249 @@ class ChatAPIView(APIView):
 
         return Response({"answer": response_data}, status=status.HTTP_200_OK)
 
+class ChatStreamAPIView(APIView):
+    bot = LazyChatBot()
+
+    @swagger_auto_schema(
+        operation_id="chat_with_bot_stream",
+        operation_summary="Chat with the bot, streaming the answer",
+        operation_description="Send a question to the bot and receive the answer as Server-Sent Events: "
+                              "one `data: {\"token\": ...}` event per token, then an `event: done` event "
+                              "carrying the full answer and its type.",
+        request_body=question_schema,
+        responses={200: "text/event-stream", 429: "Too many requests queued for the model provider",
+                   503: "Timed out waiting for the model provider"}
+    )
+    def post(self, request, *args, **kwargs):
+        """Process POST request, stream chatbot reply as Server-Sent Events"""
+        question = request.data.get('question')
+        if not question:
+            return Response({"error": "Question is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            conversation_id, group = parse_chat_scope(request.data, request.headers)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Retrieval and admission happen before the 200 is sent; only the tokens stream
+        try:
+            prepared = self.bot.prepare_stream(question, conversation_id, group)
+        except Rejected as e:
+            return Response({"error": str(e)}, status=e.status, headers={"Retry-After": str(e.retry_after)})
+        if isinstance(request._request, ASGIRequest):
+            # Under ASGI the body is iterated on the event loop, so it must not block on the ORM or the provider
+            events = asse_answer(self.bot.astream_answer(prepared))
+        else:
+            events = sse_answer(self.bot.stream_answer(prepared))
+
+        response = StreamingHttpResponse(events, content_type="text/event-stream")
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+class ChatBatchAPIView(APIView):
+    bot = LazyChatBot()
+
+    @swagger_auto_schema(
+        operation_id="chat_with_bot_batch",
+        operation_summary="Ask the bot many questions at once",
+        operation_description="Send a list of standalone questions, optionally scoped to a prompt group, and receive "
+                              "the answers in the same order. A question that fails gets an `error` instead of an "
+                              "answer; the others are still answered.",
+        request_body=batch_question_schema,
+        responses={200: batch_response_schema, 429: "Too many requests queued for the model provider",
+                   503: "Timed out waiting for the model provider"}
+    )
+    def post(self, request, *args, **kwargs):
+        """Process POST request, return one chatbot reply per question"""
+        questions = request.data.get('questions')
+        if not isinstance(questions, list) or not questions:
+            return Response({"error": "questions must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(questions) > settings.BATCH_MAX_QUESTIONS:
+            return Response({"error": f"At most {settings.BATCH_MAX_QUESTIONS} questions per batch"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            group = parse_group(request.data.get('group'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = [None if isinstance(question, str) and question.strip() else {"error": "Question is required"}
+                   for question in questions]
+        valid = [i for i, result in enumerate(results) if result is None]
+        if valid:
+            try:
+                with priority(BATCH):
+                    answers = self.bot.answer_many([questions[i] for i in valid], group)
+            except Rejected as e:
+                return Response({"error": str(e)}, status=e.status, headers={"Retry-After": str(e.retry_after)})
+            except Exception as e:
+                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            with span("classify"):
+                for i, result in zip(valid, answers):
+                    if "answer" in result:
+                        result["type"] = classify_answer(result["answer"])
+                    results[i] = result
+
+        return Response({"answers": results}, status=status.HTTP_200_OK)
+
+async def chat_async(request):
+    """
+    Async variant of ChatAPIView for questions, served when running under ASGI.
+
+    Accepts the same JSON or form body as /api/chat/ and returns the same
+    response shape. File uploads go through /api/chat/.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            return JsonResponse({"error": "JSON body must be an object"}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+    if request.FILES:
+        return JsonResponse({"error": "Upload files through /api/chat/"}, status=status.HTTP_400_BAD_REQUEST)
+
+    question = data.get('question')
+    if not question:
+        return JsonResponse({"error": "Question is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        conversation_id, group = await sync_to_async(parse_chat_scope)(data, request.headers)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        feedback = await asyncio.wait_for(ChatAPIView.bot.aanswer(question, conversation_id, group),
+                                          timeout=settings.LLM_TIMEOUT)
+    except asyncio.TimeoutError:
+        return JsonResponse({"error": "The chat bot took too long to answer"},
+                            status=status.HTTP_504_GATEWAY_TIMEOUT)
+    except Rejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status, headers={"Retry-After": str(e.retry_after)})
+
+    with span("classify"):
+        type = classify_answer(feedback)
+    response_data = {
+        "answer": feedback,
+        "type": type
+    }
+    return JsonResponse({"answer": response_data}, status=status.HTTP_200_OK)
+
+# Like DRF's APIView, the chat API is not protected by CSRF tokens
+chat_async.csrf_exempt = True
+
+def metrics(request):
+    """Request and per-stage latency histograms, token and cache counters of this process, for Prometheus."""
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def ready(request):
+    """
+    Readiness probe. The first call starts warming up the chat bot in the
+    background; until that finishes the probe answers 503, then 200 with the
+    seconds each warm-up step took.
+    """
+    from .chatbot import warm_up_in_background
+
+    warmup = warm_up_in_background()
+    if not warmup.done() or warmup.exception():
+        return JsonResponse({"status": "warming up"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JsonResponse({"status": "ready", "warm_up_seconds": warmup.result()}, status=status.HTTP_200_OK)
+
+class IngestionJobAPIView(APIView):
+    @swagger_auto_schema(
+        operation_id="retrieve_ingestion_job",
+        operation_summary="Retrieve an ingestion job",
+        operation_description="Retrieve the status and progress of a knowledge base upload by its job ID.",
+        responses={200: IngestionJobSerializer, 500: "Internal Server Error"}
+    )
+    def get(self, request, id, *args, **kwargs):
+        try:
+            job = IngestionJob.objects.get(pk=id)
+            serializer = IngestionJobSerializer(job)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        except IngestionJob.DoesNotExist:
+            return Response({"error": "Ingestion job not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class KnowledgeDocumentListAPIView(APIView):
+    @swagger_auto_schema(
+        operation_id="list_knowledge_documents",
+        operation_summary="List knowledge base documents",
+        operation_description="Retrieve the documents ingested into a knowledge base. Pass ?group= for a prompt "
+                              "group's knowledge base; omit it for the shared one.",
+        responses={200: KnowledgeDocumentSerializer(many=True), 500: "Internal Server Error"}
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            group = parse_group(request.query_params.get('group'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            documents = KnowledgeDocument.objects.filter(group=group).order_by('id')
+            serializer = KnowledgeDocumentSerializer(documents, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class KnowledgeDocumentDetailAPIView(APIView):
+    bot = LazyChatBot()
+
+    @swagger_auto_schema(
+        operation_id="retrieve_knowledge_document",
+        operation_summary="Retrieve a knowledge base document",
+        operation_description="Retrieve an ingested document and its chunk ids by its ID.",
+        responses={200: KnowledgeDocumentSerializer, 500: "Internal Server Error"}
+    )
+    def get(self, request, id, *args, **kwargs):
+        try:
+            document = KnowledgeDocument.objects.get(pk=id)
+            serializer = KnowledgeDocumentSerializer(document)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        except KnowledgeDocument.DoesNotExist:
+            return Response({"error": "Document not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @swagger_auto_schema(
+        operation_id="replace_knowledge_document",
+        operation_summary="Replace a knowledge base document",
+        operation_description="Upload a new version of a document as multipart field `file`. It is ingested in the "
+                              "background like other uploads, and the old version is deleted once it is indexed.",
+        responses={202: "Ingestion job queued", 400: "Unsupported file type", 500: "Internal Server Error"}
+    )
+    def put(self, request, id, *args, **kwargs):
+        upload_file = request.FILES.get('file')
+        if not upload_file:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if not is_ingestible(upload_file.name):
+            return Response({"error": unsupported_upload_message()}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            document = KnowledgeDocument.objects.get(pk=id)
+            job = enqueue_upload(upload_file, document.group, replaces=document.id)
+            return Response({"job_id": job.id}, status=status.HTTP_202_ACCEPTED)
+        except KnowledgeDocument.DoesNotExist:
+            return Response({"error": "Document not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @swagger_auto_schema(
+        operation_id="delete_knowledge_document",
+        operation_summary="Delete a knowledge base document",
+        operation_description="Delete a document by its ID. Its chunks stop matching immediately and their space "
+                              "is reclaimed by the next compaction.",
+        responses={200: "No Content", 500: "Internal Server Error"}
+    )
+    def delete(self, request, id, *args, **kwargs):
+        try:
+            if not self.bot.delete_document(id):
+                return Response({"error": "Document not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class PromptListCreateAPIView(APIView):
     @swagger_auto_schema(
         operation_id="list_prompts",
@@ -66,6 +443,7 @@ class PromptListCreateAPIView(APIView):
         if serializer.is_valid():
             try:
                 serializer.save()
+                prompt_resolver.invalidate()
                 return Response(serializer.data, status=status.HTTP_200_OK)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -102,6 +480,7 @@ class PromptDetailAPIView(APIView):
             if serializer.is_valid():
                 try:
                     serializer.save()
+                    prompt_resolver.invalidate()
                     return Response(serializer.data, status=status.HTTP_200_OK)
                 except Exception as e:
                     return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -121,6 +500,7 @@ class PromptDetailAPIView(APIView):
         try:
             prompt = Prompt.objects.get(pk=id)
             prompt.delete()
+            prompt_resolver.invalidate()
             return Response(status=status.HTTP_200_OK)
         except Prompt.DoesNotExist:
             return Response({"error": "Prompt not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -205,6 +585,7 @@ class PromptGroupDetailAPIView(APIView):
             if serializer.is_valid():
                 try:
                     serializer.save()
+                    prompt_resolver.invalidate()
                     return Response(serializer.data, status=status.HTTP_200_OK)
                 except Exception as e:
                     return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -224,6 +605,7 @@ class PromptGroupDetailAPIView(APIView):
         try:
             group = PromptGroup.objects.get(pk=id)
             group.delete()
+            prompt_resolver.invalidate()
             return Response(status=status.HTTP_200_OK)
         except PromptGroup.DoesNotExist:
             return Response({"error": "Prompt group not found"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "myapp.metrics.request_trace_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -131,3 +132,173 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Chat bot
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4-turbo")
+
+# Async chat view (/api/chat/async/): model calls in flight per worker, and
+# seconds before a request is answered with 504
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+# Admission control for provider calls, per worker process. Chat model and
+# embedding calls are admitted within these requests and tokens per minute (0
+# is unlimited), interactive chat first, then ingestion, then batch jobs. A
+# chat model call is charged its prompt plus LLM_COMPLETION_TOKENS up front and
+# settled once the provider reports its usage. Calls are refused with 429 when
+# their priority's queue is full, and with 503 after waiting SCHEDULER_MAX_WAIT
+# seconds.
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "500"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "0"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "0"))
+SCHEDULER_QUEUE_LIMITS = {
+    "interactive": int(os.getenv("SCHEDULER_INTERACTIVE_QUEUE", "64")),
+    "ingestion": int(os.getenv("SCHEDULER_INGESTION_QUEUE", "64")),
+    "batch": int(os.getenv("SCHEDULER_BATCH_QUEUE", "512")),
+}
+SCHEDULER_MAX_WAIT = {
+    "interactive": float(os.getenv("SCHEDULER_INTERACTIVE_MAX_WAIT", "15")),
+    "ingestion": float(os.getenv("SCHEDULER_INGESTION_MAX_WAIT", "600")),
+    "batch": float(os.getenv("SCHEDULER_BATCH_MAX_WAIT", "600")),
+}
+
+# Batch chat endpoint (/api/chat/batch/): questions accepted per request, and
+# model calls a batch keeps in flight
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "16"))
+
+# Seconds before the cached admin prompts are re-read from the database.
+# Prompt edits made through the API invalidate the cache immediately; the TTL
+# only bounds staleness in other worker processes. 0 disables expiry.
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "300"))
+
+# Directory holding the FAISS knowledge base built from uploaded documents.
+KNOWLEDGE_BASE_DIR = os.getenv("KNOWLEDGE_BASE_DIR", str(BASE_DIR / "faiss_index"))
+# Every write publishes a new index snapshot. Superseded snapshots are deleted
+# once they are neither among the newest KEEP_SNAPSHOTS nor younger than GRACE seconds.
+KNOWLEDGE_BASE_KEEP_SNAPSHOTS = int(os.getenv("KNOWLEDGE_BASE_KEEP_SNAPSHOTS", "3"))
+KNOWLEDGE_BASE_SNAPSHOT_GRACE = int(os.getenv("KNOWLEDGE_BASE_SNAPSHOT_GRACE", "300"))
+# Serve snapshots from a read-only memory map so every worker process on a host
+# shares one page-cached copy of the index instead of loading its own.
+KNOWLEDGE_BASE_MMAP = os.getenv("KNOWLEDGE_BASE_MMAP", "true").lower() in ("1", "true", "yes")
+# Each upload is stored as a new index segment. A background compaction merges
+# segments once this many of similar size (within a factor of it) accumulate. 0 disables it.
+KNOWLEDGE_BASE_COMPACTION_FACTOR = int(os.getenv("KNOWLEDGE_BASE_COMPACTION_FACTOR", "4"))
+# Deleted chunks are filtered out of searches until compaction rewrites a segment
+# once more than this fraction of it is deleted.
+KNOWLEDGE_BASE_COMPACTION_DELETED = float(os.getenv("KNOWLEDGE_BASE_COMPACTION_DELETED", "0.2"))
+
+# Uploaded documents are split into overlapping chunks of this many characters
+INGESTION_CHUNK_SIZE = int(os.getenv("INGESTION_CHUNK_SIZE", "1000"))
+INGESTION_CHUNK_OVERLAP = int(os.getenv("INGESTION_CHUNK_OVERLAP", "200"))
+
+# Uploads are stored here and ingested by a pool of INGESTION_WORKERS threads
+INGESTION_UPLOAD_DIR = os.getenv("INGESTION_UPLOAD_DIR", str(BASE_DIR / "uploads"))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+# A worker process renews the jobs it holds; queued or running jobs not renewed
+# for this many seconds, e.g. after a restart, are taken over by another worker
+INGESTION_JOB_LEASE = int(os.getenv("INGESTION_JOB_LEASE", "60"))
+
+# PDF pages are extracted in a process pool, this many pages per task.
+# PDF_EXTRACTION_WORKERS=0 uses one worker per CPU core.
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "0"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+
+# Embedding model, and the on-disk cache of vectors keyed by (model, text)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", str(BASE_DIR / "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+# Chunks per embedding request, and how many requests run concurrently
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+
+# Conversation history per conversation id. Each conversation keeps only its
+# most recent messages that fit in CONVERSATION_TOKEN_WINDOW tokens. Point the
+# cache at a shared backend (e.g. FileBasedCache) when running several workers.
+CONVERSATION_TOKEN_WINDOW = int(os.getenv("CONVERSATION_TOKEN_WINDOW", "3000"))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "conversations": {
+        "BACKEND": os.getenv("CONVERSATION_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CONVERSATION_CACHE_LOCATION", "conversations"),
+        "TIMEOUT": int(os.getenv("CONVERSATION_TTL", "86400")),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CONVERSATION_MAX_ENTRIES", "10000"))},
+    },
+}
+
+# Semantic answer cache for standalone questions: cosine similarity a previous
+# question must reach to reuse its answer, entry lifetime in seconds, and size.
+# With text-embedding-ada-002 questions that differ in one word still score about
+# 0.95, so only close rewordings should clear the threshold.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+# Retrieval: chunks fetched per question, and the relevance score a chunk needs
+# to be put in the prompt. Questions without relevant chunks go straight to the
+# model without any context. The score is the cosine similarity between question
+# and chunk, raised by keyword matches. text-embedding-ada-002 scores even
+# unrelated texts about 0.7, hence 0.8; the text-embedding-3 models spread
+# scores wider and need a threshold around 0.4.
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+RAG_RELEVANCE_THRESHOLD = float(os.getenv("RAG_RELEVANCE_THRESHOLD", "0.8"))
+
+# Prompt assembly: tokens one model call may use for the system prompt, the
+# question, the retrieved chunks (best first, whole chunks only) and then the
+# most recent turns. Retrieval embeds the question alone unless
+# RAG_QUERY_PREVIOUS_TURN also prefixes the previous question, for follow-ups.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+RAG_QUERY_PREVIOUS_TURN = os.getenv("RAG_QUERY_PREVIOUS_TURN", "false").lower() in ("1", "true", "yes")
+
+# Hybrid retrieval: how strongly a BM25 keyword match lifts a chunk's vector
+# relevance towards 1 (0 disables lexical matching, 1 lets a perfect match win)
+KNOWLEDGE_BASE_LEXICAL_WEIGHT = float(os.getenv("KNOWLEDGE_BASE_LEXICAL_WEIGHT", "0.5"))
+
+# Approximate nearest neighbour search for large knowledge bases. Once an index
+# holds KNOWLEDGE_BASE_ANN_MIN_CHUNKS chunks it is retrained as the given type:
+# "flat" (exact, never migrated), "ivf", "ivfpq" (product quantized) or "hnsw".
+KNOWLEDGE_BASE_INDEX_TYPE = os.getenv("KNOWLEDGE_BASE_INDEX_TYPE", "flat")
+KNOWLEDGE_BASE_ANN_MIN_CHUNKS = int(os.getenv("KNOWLEDGE_BASE_ANN_MIN_CHUNKS", "50000"))
+KNOWLEDGE_BASE_TRAIN_SAMPLE = int(os.getenv("KNOWLEDGE_BASE_TRAIN_SAMPLE", "100000"))
+# IVF: number of clusters (0 picks 4 * sqrt(chunks)) and clusters probed per query
+KNOWLEDGE_BASE_IVF_NLIST = int(os.getenv("KNOWLEDGE_BASE_IVF_NLIST", "0"))
+KNOWLEDGE_BASE_IVF_NPROBE = int(os.getenv("KNOWLEDGE_BASE_IVF_NPROBE", "16"))
+# IVF-PQ: sub-quantizers (must divide the embedding size) and bits per code
+KNOWLEDGE_BASE_PQ_M = int(os.getenv("KNOWLEDGE_BASE_PQ_M", "64"))
+KNOWLEDGE_BASE_PQ_NBITS = int(os.getenv("KNOWLEDGE_BASE_PQ_NBITS", "8"))
+# HNSW: graph degree, and candidate list sizes while building and searching
+KNOWLEDGE_BASE_HNSW_M = int(os.getenv("KNOWLEDGE_BASE_HNSW_M", "32"))
+KNOWLEDGE_BASE_HNSW_EF_CONSTRUCTION = int(os.getenv("KNOWLEDGE_BASE_HNSW_EF_CONSTRUCTION", "80"))
+KNOWLEDGE_BASE_HNSW_EF_SEARCH = int(os.getenv("KNOWLEDGE_BASE_HNSW_EF_SEARCH", "64"))
+
+# Every /api/ request is logged as one JSON line on the "myapp.requests" logger:
+# request id, route, status, total and per-stage milliseconds, token counts and
+# cache hits. Latency histograms are served at /api/metrics/ for Prometheus.
+REQUEST_LOG_LEVEL = os.getenv("REQUEST_LOG_LEVEL", "INFO")
+# Diagnostics of the chat bot, knowledge base and ingestion jobs go to the
+# "myapp" loggers; DEBUG adds a line each time a worker opens a new index version.
+APP_LOG_LEVEL = os.getenv("APP_LOG_LEVEL", "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "message": {"format": "%(message)s"},
+        "diagnostic": {"format": "%(asctime)s %(levelname)s %(name)s: %(message)s"},
+    },
+    "handlers": {
+        "requests": {"class": "logging.StreamHandler", "formatter": "message"},
+        "diagnostics": {"class": "logging.StreamHandler", "formatter": "diagnostic"},
+    },
+    "loggers": {
+        "myapp": {"handlers": ["diagnostics"], "level": APP_LOG_LEVEL},
+        "myapp.requests": {"handlers": ["requests"], "level": REQUEST_LOG_LEVEL, "propagate": False},
+    },
+}
@@ -10,6 +10,10 @@ import ChatMessage from "../components/Chat/ChatMessage";
 import InputBox from "../components/Chat/InputBox";
 import { post } from "../api";
 
+// Generate an id that groups the messages of one conversation on the server
+const newConversationId = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 // Chat component to handle the chat interface
 const Chat = () => {
   const [isSidebarVisible, setIsSidebarVisible] = useState(
@@ -20,6 +24,9 @@ const Chat = () => {
     return JSON.parse(localStorage.getItem("chatMessages") || "[]"); // Retrieve messages from local storage
   });
   const [isLoading, setIsLoading] = useState(false); // State to manage loading status
+  const conversationIdRef = useRef(
+    localStorage.getItem("conversationId") || newConversationId()
+  ); // Id of the current conversation, kept across reloads
   const messagesEndRef = useRef(null); // Reference to the end of the messages container
   const navigate = useNavigate(); // Hook to navigate programmatically
 
@@ -81,6 +88,7 @@ const Chat = () => {
       // Create a formData object to store file
       const formData = new FormData();
       formData.append("question", textMessages);
+      formData.append("conversation_id", conversationIdRef.current);
       uploadedFiles.forEach((file) => {
         formData.append(`image`, file);
       });
@@ -120,6 +128,7 @@ const Chat = () => {
   // Handle screen size change
   useEffect(() => {
     localStorage.setItem("chatMessages", JSON.stringify(messages)); // Save messages to local storage
+    localStorage.setItem("conversationId", conversationIdRef.current);
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" }); // Scroll to the end of messages
 
     // The View height used to obtain the actual screen height of the mobile device
@@ -152,6 +161,8 @@ const Chat = () => {
   const resetConversation = useCallback(() => {
     setMessages([]);
     localStorage.removeItem("chatMessages");
+    conversationIdRef.current = newConversationId(); // Start a fresh server-side history
+    localStorage.setItem("conversationId", conversationIdRef.current);
   }, []);
 
   // Function to navigate to the admin page